@@ -18,6 +18,8 @@ using namespace websockets;
 #define LED_RES -1
 #define OLED_SCL 8
 #define OLED_SDA 9
+#define BATCH_SIZE 10
+#define BATCH_INTERVAL 5000
 
 U8G2_SSD1306_128X64_NONAME_F_HW_I2C u8g2(U8G2_R0, /* reset=*/U8X8_PIN_NONE);
 DHT dht(DHTPIN, DHTTYPE);
@@ -29,6 +31,16 @@ int currentLED = 0;
 bool  ledState = false; 
 unsigned long lastWiFiRetry = 0;
 unsigned long lastWsRetry = 0;
+bool useMsgPack = false;
+
+struct Reading {
+  const char* sensor_id;
+  unsigned long millis;
+  float value;
+};
+Reading batch[BATCH_SIZE];
+int batchCount = 0;
+unsigned long lastBatch = 0;
 
 const char* ssid = WIFI_SSID;
 const char* password = WIFI_PASSWORD;
@@ -80,10 +92,50 @@ void sendSensor(const char* sensor_id, float value) {
   Serial.println("Sent: " + payload);
 }
 
+void queueReading(const char* sensor_id, float value) {
+  if (batchCount < BATCH_SIZE) {
+    batch[batchCount++] = { sensor_id, millis(), value };
+  }
+}
+
+// Readings are sent in one sensor_batch frame; timestamps are millis() so the
+// server can place them relative to "now" without a synced clock.
+void sendBatch() {
+  if (batchCount == 0) return;
+
+  DynamicJsonDocument doc(256 + batchCount * 64);
+  doc["msg_type"] = "sensor_batch";
+  doc["device_id"] = device_id;
+  doc["now"] = millis();
+  JsonArray readings = doc.createNestedArray("readings");
+  for (int i = 0; i < batchCount; i++) {
+    JsonArray r = readings.createNestedArray();
+    r.add(batch[i].sensor_id);
+    r.add(batch[i].millis);
+    r.add(batch[i].value);
+  }
+
+  if (useMsgPack) {
+    size_t len = measureMsgPack(doc);
+    char buffer[len];
+    serializeMsgPack(doc, buffer, len);
+    client.sendBinary(buffer, len);
+  } else {
+    String payload;
+    serializeJson(doc, payload);
+    client.send(payload);
+  }
+  Serial.printf("Sent batch: %d readings\n", batchCount);
+  batchCount = 0;
+  lastBatch = millis();
+}
+
 void sendRegistration() {
   StaticJsonDocument<128> doc;
   doc["msg_type"] = "register";
   doc["device_id"] = device_id;
+  JsonArray encodings = doc.createNestedArray("encodings");
+  encodings.add("msgpack");
   String payload;
   serializeJson(doc, payload);
   client.send(payload);
@@ -104,10 +156,23 @@ void handleMessage(WebsocketsMessage msg) {
     if(strcasecmp(cmd, "toggle")  == 0) { digitalWrite(LED_PIN, !digitalRead(LED_PIN)); ledState = !ledState; }
     else if(strcasecmp(cmd, "on")  == 0) { digitalWrite(LED_PIN, HIGH); ledState = true; }
     else if(strcasecmp(cmd, "off") == 0) { digitalWrite(LED_PIN, LOW);  ledState = false; }
+
+    if (doc.containsKey("cmd_id")) {
+      StaticJsonDocument<128> ack;
+      ack["msg_type"] = "command_ack";
+      ack["device_id"] = device_id;
+      ack["cmd_id"] = doc["cmd_id"];
+      ack["status"] = "ok";
+      String payload;
+      serializeJson(ack, payload);
+      client.send(payload);
+    }
   }
   else if (strcmp(type, "registration_ack") == 0 && strcmp(target, device_id) == 0) {
     long ts = doc["timestamp"];
     setTime(ts);
+    const char* encoding = doc["encoding"] | "json";
+    useMsgPack = strcmp(encoding, "msgpack") == 0;
     Serial.printf("Server time synced: %ld\n", ts);
     drawScreen("Time synced");
   }
@@ -140,6 +205,7 @@ void reconnect() {
   Serial.println("Connected to server");
   drawScreen("Server Connected");
   delay(1000);
+  useMsgPack = false;
   sendRegistration();
 }
 
@@ -198,9 +264,13 @@ void loop() {
   if (millis() - lastSensor >= 1000) {
     currentTemp = dht.readTemperature();
     currentHumi = dht.readHumidity();
-    sendSensor("temperature", currentTemp);
-    sendSensor("humidity", currentHumi);
+    queueReading("temperature", currentTemp);
+    queueReading("humidity", currentHumi);
     drawScreen();
     lastSensor = millis();
   }
+
+  if (batchCount >= BATCH_SIZE || (batchCount > 0 && millis() - lastBatch >= BATCH_INTERVAL)) {
+    sendBatch();
+  }
 }
\ No newline at end of file
@@ -1,56 +1,59 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend } from "recharts";
 import { API_URL } from "../config";
+import { subscribe } from "../liveEvents";
 import "./GraphCard.css";
 
 interface GraphCardProps {
     deviceId: string;
 }
 
+// Hourly averages move slowly, so live readings only trigger a refresh at
+// most this often instead of on every sample.
+const REFRESH_INTERVAL = 60000;
+
 const GraphCard = ({ deviceId }: GraphCardProps) => {
 
     const [temperatureData, setTemperatureData] = useState<any[]>([]);
     const [humidityData, setHumidityData] = useState<any[]>([]);
+    const lastRefresh = useRef<number>(0);
 
 
-    const getTemperatureData = async () => {
+    const getHistoryData = async () => {
+        lastRefresh.current = Date.now();
         try {
-            const response = await fetch(`${API_URL}/api/sensor-history/${deviceId}?sensor_id=temperature&hours=24`);
+            const seriesParam = [`${deviceId}:temperature`, `${deviceId}:humidity`].join(",");
+            const response = await fetch(`${API_URL}/api/sensor-history-batch?series=${encodeURIComponent(seriesParam)}&hours=24`);
             if (response.ok) {
                 const data = await response.json();
-                console.log('Temperature hourly data:', data);
-                setTemperatureData(data.data || []);
+                console.log('Hourly history data:', data);
+                const timestamps: string[] = data.timestamps || [];
+                const toPoints = (values: (number | null)[] = []) =>
+                    timestamps
+                        .map((timestamp, i) => ({ timestamp, value: values[i] }))
+                        .filter((point) => point.value !== null);
+                const series = data.series || [];
+                setTemperatureData(toPoints(series[0]?.values));
+                setHumidityData(toPoints(series[1]?.values));
             } else {
-                console.error("Failed to get temperature data");
+                console.error("Failed to get history data");
             }
         } catch (err) {
-            console.error("Error fetching temperature data:", err);
-        }
-    };
-
-    const getHumidityData = async () => {
-        try {
-            const response = await fetch(`${API_URL}/api/sensor-history/${deviceId}?sensor_id=humidity&hours=24`);
-            if (response.ok) {
-                const data = await response.json();
-                console.log('Humidity hourly data:', data);
-                setHumidityData(data.data || []);
-            } else {
-                console.error("Failed to get humidity data");
-            }
-        } catch (err) {
-            console.error("Error fetching humidity data:", err);
+            console.error("Error fetching history data:", err);
         }
     };
 
     useEffect(() => {
-        getTemperatureData();
-        getHumidityData();
-        const interval = setInterval(() => {
-            getTemperatureData();
-            getHumidityData();
-        }, 60000);
-        return () => clearInterval(interval);
+        getHistoryData();
+        return subscribe({
+            topics: ["sensor"],
+            deviceIds: [deviceId],
+            onEvent: () => {
+                if (Date.now() - lastRefresh.current >= REFRESH_INTERVAL) {
+                    getHistoryData();
+                }
+            },
+        });
     }, []);
 
     const formatTimestamp = (timestamp: string) => {
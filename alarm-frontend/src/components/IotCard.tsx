@@ -1,6 +1,7 @@
 import "./IotCard.css";
 import { useEffect, useState } from "react";
 import { API_URL } from "../config";
+import { subscribe } from "../liveEvents";
 
 const IotCard = () => {
   const [sensorData, setSensorData] = useState<string | null>(null);
@@ -36,10 +37,18 @@ const IotCard = () => {
 
   useEffect(() => {
     getDeviceList();
-    const interval = setInterval(() => {
-      getDeviceList();
-    }, 1000);
-    return () => clearInterval(interval);
+    return subscribe({
+      topics: ["device"],
+      onConnect: getDeviceList,
+      onEvent: (event) => {
+        const device = event.device_id as string;
+        setDeviceList((devices) =>
+          event.status === "connected"
+            ? devices.includes(device) ? devices : [...devices, device]
+            : devices.filter((d) => d !== device)
+        );
+      },
+    });
   }, []);
 
   return (
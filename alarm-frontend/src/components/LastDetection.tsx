@@ -1,5 +1,6 @@
 import { useState, useEffect } from "react";
 import { API_URL } from "../config";
+import { subscribe } from "../liveEvents";
 import "./LastDetection.css";
 
 const LastDetection = () => {
@@ -15,7 +16,7 @@ const LastDetection = () => {
                 if (data.status === 'success') {
                     setDetectionResult(data.detection_result);
                     setDetectionTime(data.detection_time);
-                    setImage(data.image);
+                    setImage(data.image_url);
                 } else {
                     setDetectionResult(null);
                     setDetectionTime(null);
@@ -31,10 +32,15 @@ const LastDetection = () => {
     };
     useEffect(() => {
         getLastDetection();
-        const interval = setInterval(() => {
-            getLastDetection();
-        }, 1000);
-        return () => clearInterval(interval);
+        return subscribe({
+            topics: ["detection"],
+            onConnect: getLastDetection,
+            onEvent: (event) => {
+                setDetectionResult(event.result);
+                setDetectionTime(event.timestamp);
+                setImage(event.image_url);
+            },
+        });
     }, []);
     return (
         <div className="last-detection">
@@ -44,7 +50,7 @@ const LastDetection = () => {
             <div className="last-detection-body">
                 <p>Detection Result: {detectionResult ? detectionResult : "No detection result"}</p>
                 <p>Detection Time: {detectionTime ? detectionTime : "No detection time"}</p>
-                {image && <img src={`data:image/jpeg;base64,${image}`} alt="Last Detection" />}
+                {image && <img src={`${API_URL}${image}`} alt="Last Detection" />}
             </div>
         </div>
     );
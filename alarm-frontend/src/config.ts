@@ -8,8 +8,13 @@ export const API_URL =
   API_CONFIG[process.env.NODE_ENV as keyof typeof API_CONFIG] ||
   API_CONFIG.development;
 
+export const WS_URL =
+  process.env.REACT_APP_WS_URL ||
+  `ws://${window.location.hostname || "localhost"}:5501`;
+
 export const CONFIG = {
   API_URL,
+  WS_URL,
   TIMEOUT: 5000,
 };
 
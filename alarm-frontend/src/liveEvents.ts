@@ -0,0 +1,59 @@
+import { WS_URL } from "./config";
+
+export type Topic = "sensor" | "device" | "detection";
+
+export interface LiveEvent {
+  msg_type: "event";
+  topic: Topic;
+  device_id?: string;
+  [key: string]: any;
+}
+
+interface Subscription {
+  topics: Topic[];
+  deviceIds?: string[];
+  onEvent: (event: LiveEvent) => void;
+  onConnect?: () => void;
+}
+
+const RECONNECT_DELAY = 3000;
+
+// Opens one WebSocket per subscription and reconnects until unsubscribed.
+// onConnect fires after every (re)connect so callers can resync state they
+// may have missed while disconnected.
+export const subscribe = ({ topics, deviceIds, onEvent, onConnect }: Subscription) => {
+  let socket: WebSocket | null = null;
+  let retry: ReturnType<typeof setTimeout> | null = null;
+  let closed = false;
+
+  const connect = () => {
+    socket = new WebSocket(WS_URL);
+    socket.onopen = () => {
+      socket?.send(JSON.stringify({ msg_type: "subscribe", topics, device_ids: deviceIds }));
+    };
+    socket.onmessage = (message) => {
+      try {
+        const data = JSON.parse(message.data);
+        if (data.msg_type === "subscribe_ack") {
+          onConnect?.();
+        } else if (data.msg_type === "event") {
+          onEvent(data);
+        }
+      } catch (err) {
+        console.error("Invalid live event:", err);
+      }
+    };
+    socket.onclose = () => {
+      if (!closed) {
+        retry = setTimeout(connect, RECONNECT_DELAY);
+      }
+    };
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    if (retry) clearTimeout(retry);
+    socket?.close();
+  };
+};
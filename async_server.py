@@ -0,0 +1,303 @@
+"""
+Unified asyncio server
+
+Serves the Flask app and the device WebSocket endpoint from a single event
+loop using aiohttp (optional dependency). The Flask views are unchanged:
+each request runs the WSGI app in a thread pool, so camera and database
+work never blocks the loop, while device sockets, heartbeats, command
+acks and browser events all stay on the loop with no thread hops.
+
+Devices keep connecting to the WebSocket port; the HTTP port also accepts
+WebSocket upgrades on /ws.
+"""
+import asyncio
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from websocket_server import WebsocketServer
+
+try:
+    from aiohttp import WSMsgType, web
+except ImportError:
+    web = None
+
+# Left for aiohttp to manage on the outgoing response
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'upgrade'}
+
+
+class AiohttpSocket:
+    """Gives an aiohttp WebSocketResponse the parts of the websockets
+    connection API that WebsocketServer uses."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self._pong_waiters = []
+
+    def __aiter__(self):
+        return self._messages()
+
+    async def _messages(self):
+        async for msg in self.ws:
+            if msg.type in (WSMsgType.TEXT, WSMsgType.BINARY):
+                yield msg.data
+            elif msg.type == WSMsgType.PONG:
+                waiters, self._pong_waiters = self._pong_waiters, []
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+            elif msg.type == WSMsgType.ERROR:
+                break
+
+    async def send(self, message):
+        if isinstance(message, bytes):
+            await self.ws.send_bytes(message)
+        else:
+            await self.ws.send_str(message)
+
+    async def ping(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self._pong_waiters.append(waiter)
+        await self.ws.ping()
+        return waiter
+
+    async def close(self, code=1000, reason=""):
+        await self.ws.close(code=code, message=reason.encode())
+
+
+class _StreamInput:
+    """Blocking wsgi.input over the aiohttp request body, for use from the
+    WSGI thread pool, so uploads stream instead of being read up front."""
+
+    def __init__(self, content, loop):
+        self.content = content
+        self.loop = loop
+        # Tail of a line cut short by readline(size)
+        self._pending = b''
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def read(self, size=-1):
+        pending, self._pending = self._pending, b''
+        if size is None or size < 0:
+            return pending + self._run(self.content.read())
+        if pending:
+            self._pending = pending[size:]
+            return pending[:size]
+        return self._run(self.content.read(size))
+
+    def readline(self, size=-1):
+        if b'\n' in self._pending:
+            end = self._pending.index(b'\n') + 1
+            line, self._pending = self._pending[:end], self._pending[end:]
+        else:
+            pending, self._pending = self._pending, b''
+            line = pending + self._run(self.content.readline())
+        if size is not None and 0 <= size < len(line):
+            line, self._pending = line[:size], line[size:] + self._pending
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+class UnifiedServer(WebsocketServer):
+
+    # Response chunks buffered between a WSGI worker and the loop
+    STREAM_BUFFER = 8
+
+    def __init__(self, app, http_port=5502, http_workers=16, **kwargs):
+        if web is None:
+            raise RuntimeError("aiohttp is required for the unified server")
+        super().__init__(**kwargs)
+        self.app = app
+        self.http_port = http_port
+        self.http_executor = ThreadPoolExecutor(max_workers=http_workers,
+                                                thread_name_prefix="http")
+
+    def _send_broadcast(self, targets, message):
+        # aiohttp buffers writes itself, so the same don't-wait behaviour is
+        # a task per subscriber
+        for websocket in targets:
+            asyncio.ensure_future(websocket.send(message))
+
+    async def _handle_websocket(self, request):
+        ws = web.WebSocketResponse(autoping=False, max_msg_size=4 * self.max_message_size)
+        await ws.prepare(request)
+        await self.handle_client(AiohttpSocket(ws))
+        return ws
+
+    def _environ(self, request, body):
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': request.path,
+            'QUERY_STRING': request.query_string,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.http_port),
+            'SERVER_PROTOCOL': f'HTTP/{request.version.major}.{request.version.minor}',
+            'REMOTE_ADDR': request.remote or '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': request.scheme,
+            'wsgi.input': body,
+            # _StreamInput reads to the end of the body, so chunked uploads
+            # (no Content-Length) are readable; without this Werkzeug treats
+            # them as empty
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in request.headers.items():
+            key = name.upper().replace('-', '_')
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[key] = value
+            else:
+                key = 'HTTP_' + key
+                environ[key] = environ[key] + ',' + value if key in environ else value
+        return environ
+
+    def _run_wsgi(self, environ, loop, queue, cancelled):
+        # The whole WSGI call runs in this one pool thread, from app() through
+        # iteration to close(), so state the app ties to its thread or
+        # context (stream_with_context, contextvars) is torn down where it was
+        # set up. Events go to the loop through a bounded queue, so a slow
+        # client also slows the producer.
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = headers
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def send(kind, value=None):
+            if not started.get('sent'):
+                started['sent'] = True
+                put(('start', (started['status'], started['headers'])))
+            put((kind, value))
+
+        try:
+            result = self.app(environ, start_response)
+            try:
+                for chunk in result:
+                    if cancelled.is_set():
+                        return
+                    if chunk:
+                        send('chunk', chunk)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            send('end')
+        except Exception as e:
+            if not cancelled.is_set():
+                put(('error', e))
+
+    async def _handle_http(self, request):
+        if request.headers.get('Upgrade', '').lower() == 'websocket' and request.path == '/ws':
+            return await self._handle_websocket(request)
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.STREAM_BUFFER)
+        cancelled = threading.Event()
+        environ = self._environ(request, _StreamInput(request.content, loop))
+        worker = loop.run_in_executor(self.http_executor, self._run_wsgi,
+                                      environ, loop, queue, cancelled)
+        response = None
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == 'start':
+                    # Streamed responses (exports) never sit in memory as a whole
+                    status, headers = value
+                    code, reason = status.split(' ', 1)
+                    response = web.StreamResponse(status=int(code), reason=reason)
+                    for name, header in headers:
+                        if name.lower() not in HOP_BY_HOP_HEADERS:
+                            response.headers.add(name, header)
+                    await response.prepare(request)
+                elif kind == 'chunk':
+                    await response.write(value)
+                elif kind == 'end':
+                    await response.write_eof()
+                    return response
+                else:
+                    raise value
+        finally:
+            # Stop the worker early if the client went away, and keep taking
+            # from the queue so it is never stuck handing over a chunk
+            cancelled.set()
+            while not worker.done():
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({worker, getter}, return_when=asyncio.FIRST_COMPLETED)
+                getter.cancel()
+
+    async def _serve(self):
+        self._start_background()
+
+        http_app = web.Application()
+        http_app.router.add_route('*', '/{path:.*}', self._handle_http)
+        http_runner = web.AppRunner(http_app, access_log=None)
+        await http_runner.setup()
+        await web.TCPSite(http_runner, self.host, self.http_port).start()
+
+        # Devices keep their existing URL on the WebSocket port
+        device_app = web.Application()
+        device_app.router.add_get('/{path:.*}', self._handle_websocket)
+        device_runner = web.AppRunner(device_app, access_log=None)
+        await device_runner.setup()
+        await web.TCPSite(device_runner, self.host, self.port,
+                          reuse_port=self.reuse_port or None).start()
+
+        print(f"Unified server started: HTTP {self.host}:{self.http_port}, "
+              f"WebSocket {self.host}:{self.port}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await http_runner.cleanup()
+            await device_runner.cleanup()
+
+    def run(self):
+        # Blocks; the loop runs in the calling thread
+        asyncio.run(self._serve())
+
+
+def check(port=5590):
+    # Round-trips a chunked upload and a streamed response through the WSGI
+    # bridge: python async_server.py
+    import http.client
+    import threading
+    import time
+    from flask import Flask, Response, request
+
+    app = Flask(__name__)
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        body = request.stream.read()
+        return Response((body[i:i + 1000] for i in range(0, len(body), 1000)))
+
+    server = UnifiedServer(app, http_port=port, host='127.0.0.1', port=port + 1)
+    threading.Thread(target=server.run, daemon=True).start()
+    time.sleep(1)
+
+    payload = b''.join(b'{"n": %d}\n' % i for i in range(20000))
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('POST', '/echo', body=iter([payload[:70000], payload[70000:]]),
+                 encode_chunked=True, headers={'Transfer-Encoding': 'chunked'})
+    echoed = conn.getresponse().read()
+    if echoed != payload:
+        raise SystemExit(f"Chunked upload check failed: sent {len(payload)} bytes, "
+                         f"got {len(echoed)} back")
+    print(f"Chunked upload check passed ({len(payload)} bytes)")
+
+
+if __name__ == '__main__':
+    check()
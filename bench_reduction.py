@@ -0,0 +1,148 @@
+"""
+HOG feature reduction benchmark
+
+Extracts features from the training dataset once, then trains the linear
+SVM on the full features and behind PCA / random projection at each target
+size. For every model it reports test accuracy, fit time, pickle and .npz
+size, and single-frame and batch predict latency, so the smallest size
+that keeps accuracy can be picked for training.py (REDUCTION /
+REDUCED_DIM). Images are used as-is, without training.py's augmentation,
+and split the same way (test_size 0.15, random_state 30).
+
+    python bench_reduction.py --dims 32,64,128,256,512 --output reduction.json
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import time
+
+import cv2
+import joblib
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from bench_sensor_db import git_revision, summarize
+from classifier import FeaturePipeline
+from feature_reduction import REDUCTION_METHODS, make_model
+from linear_model import from_sklearn
+
+
+def load_images(directory):
+    return [cv2.imread(os.path.join(directory, name)) for name in sorted(os.listdir(directory))
+            if name.endswith(('.jpg', '.png'))]
+
+
+def time_predict(model, X, repeat):
+    # Single-frame latency cycles through the test rows
+    samples = []
+    for i in range(repeat):
+        row = X[i % len(X)][None, :]
+        start = time.perf_counter()
+        model.predict(row)
+        samples.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    model.predict(X)
+    batch_ms = (time.perf_counter() - start) * 1000
+    return summarize(samples), round(batch_ms, 3)
+
+
+def bench_model(name, method, dim, data, repeat):
+    X_train, X_test, y_train, y_test = data
+    model = make_model(method, dim)
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_s = time.perf_counter() - start
+
+    predicted = model.predict(X_test)
+    pickled = io.BytesIO()
+    joblib.dump(model, pickled)
+    linear = from_sklearn(model)
+    exported = io.BytesIO()
+    linear.save(exported)
+
+    svm = model.steps[-1][1] if hasattr(model, 'steps') else model
+    predict, batch_ms = time_predict(model, X_test, repeat)
+    npz_predict, npz_batch_ms = time_predict(linear, X_test, repeat)
+    return {
+        'name': name,
+        'method': method,
+        'dim': dim if method else X_train.shape[1],
+        'accuracy': round(float(np.mean(predicted == y_test)), 4),
+        'fit_s': round(fit_s, 3),
+        'support_vectors': int(svm.n_support_.sum()),
+        'pickle_bytes': pickled.getbuffer().nbytes,
+        'npz_bytes': exported.getbuffer().nbytes,
+        'npz_agreement': round(float(np.mean(linear.predict(X_test) == predicted)), 4),
+        'predict': predict,
+        'predict_batch_ms': batch_ms,
+        'npz_predict': npz_predict,
+        'npz_predict_batch_ms': npz_batch_ms
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HOG feature reduction benchmark')
+    parser.add_argument('--on-bed', default='./3127_dataset/on-bed', help='on-bed image directory')
+    parser.add_argument('--off-bed', default='./3127_dataset/off-bed', help='off-bed image directory')
+    parser.add_argument('--methods', default=','.join(REDUCTION_METHODS),
+                        help='Comma separated reduction methods')
+    parser.add_argument('--dims', default='32,64,128,256,512', help='Comma separated target dimensions')
+    parser.add_argument('--repeat', type=int, default=200, help='Single-frame predictions per model')
+    parser.add_argument('--output', default='reduction_results.json', help='JSON output path')
+    args = parser.parse_args()
+
+    methods = [method for method in args.methods.split(',') if method]
+    dims = [int(dim) for dim in args.dims.split(',')]
+
+    on_bed = load_images(args.on_bed)
+    off_bed = load_images(args.off_bed)
+    print(f"[Bench] Extracting features from {len(on_bed)} on-bed / {len(off_bed)} off-bed images")
+    pipeline = FeaturePipeline()
+    images = on_bed + off_bed
+    samples = []
+    X = np.empty((len(images), pipeline.dim), np.float32)
+    for i, image in enumerate(images):
+        start = time.perf_counter()
+        X[i] = pipeline.extract(image)[0]
+        samples.append((time.perf_counter() - start) * 1000)
+    y = np.hstack([np.ones(len(on_bed)), np.zeros(len(off_bed))])
+    data = train_test_split(X, y, test_size=0.15, random_state=30)
+
+    report = {
+        'meta': {
+            'started_at': datetime.datetime.utcnow().isoformat() + 'Z',
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+            'images': len(images),
+            'features': pipeline.dim
+        },
+        'extract': summarize(samples),
+        'results': []
+    }
+
+    configs = [('full', None, None)]
+    configs += [(f'{method}-{dim}', method, dim) for method in methods for dim in dims]
+    for name, method, dim in configs:
+        if method == 'pca' and dim > min(len(data[0]), pipeline.dim):
+            print(f"[Bench] {name:>12}  skipped: PCA needs at least {dim} training images")
+            continue
+        result = bench_model(name, method, dim, data, args.repeat)
+        report['results'].append(result)
+        print(f"[Bench] {name:>12}  acc {result['accuracy']:.2%}  fit {result['fit_s']:.2f}s  "
+              f"pickle {result['pickle_bytes'] // 1024} KB  "
+              f"predict p50 {result['predict']['p50_ms']:.3f} ms  "
+              f"npz p50 {result['npz_predict']['p50_ms']:.3f} ms")
+
+    print(f"[Bench] Feature extraction p50 {report['extract']['p50_ms']:.3f} ms per frame")
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"[Bench] Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+SensorDB benchmark suite
+
+Builds synthetic databases of several sizes in a temp directory and
+measures insert throughput, history query latency and detection history
+latency. Results are written as JSON so runs can be compared across
+versions.
+
+    python bench_sensor_db.py --sizes 100000,1000000,10000000 --output bench.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+
+from sensor_db import SensorDB
+
+SENSORS = ('temperature', 'humidity')
+
+
+def summarize(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        'runs': len(ordered),
+        'mean_ms': round(statistics.mean(ordered), 3),
+        'p50_ms': round(ordered[len(ordered) // 2], 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        'max_ms': round(ordered[-1], 3)
+    }
+
+
+def time_call(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def open_db(workdir, name):
+    # Keep every tier for the whole synthetic span so queries hit the tier
+    # they would in production rather than an empty one.
+    return SensorDB(
+        os.path.join(workdir, name + '.db'),
+        image_dir=os.path.join(workdir, name + '_images'),
+        raw_retention_hours=24 * 365,
+        minute_retention_days=365
+    )
+
+
+def build_sensor_db(db, rows, devices, chunk_size=50000):
+    # One reading per sensor per second, ending now, written through the same
+    # batch path as the ingest writer so rollups are populated too.
+    series = [(f'device-{d}', sensor) for d in range(devices) for sensor in SENSORS]
+    seconds = max(1, rows // len(series))
+    end = int(time.time())
+    start = end - seconds
+    rng = random.Random(42)
+
+    chunk = []
+    written = 0
+    build_start = time.perf_counter()
+    for offset in range(seconds):
+        ts = start + offset
+        for device_id, sensor_id in series:
+            base = 24.0 if sensor_id == 'temperature' else 55.0
+            chunk.append((device_id, sensor_id, base + rng.uniform(-2, 2), ts))
+            if len(chunk) >= chunk_size:
+                db._write_sensor_rows(chunk)
+                written += len(chunk)
+                chunk = []
+    if chunk:
+        db._write_sensor_rows(chunk)
+        written += len(chunk)
+    return {
+        'rows': written,
+        'span_hours': round(seconds / 3600, 2),
+        'build_seconds': round(time.perf_counter() - build_start, 2)
+    }
+
+
+def bench_inserts(workdir, count):
+    results = {}
+
+    db = open_db(workdir, 'insert_single')
+    start = time.perf_counter()
+    for i in range(count):
+        db.insert_sensor_data('device-0', 'temperature', 20.0 + i % 10)
+        db.flush()
+    elapsed = time.perf_counter() - start
+    results['single_row'] = {
+        'rows': count,
+        'rows_per_second': round(count / elapsed, 1)
+    }
+    db.close()
+
+    db = open_db(workdir, 'insert_batched')
+    start = time.perf_counter()
+    for i in range(count):
+        db.insert_sensor_data('device-0', 'temperature', 20.0 + i % 10)
+    db.flush()
+    elapsed = time.perf_counter() - start
+    results['batched'] = {
+        'rows': count,
+        'rows_per_second': round(count / elapsed, 1),
+        'write_stats': db.get_write_stats()
+    }
+    db.close()
+    return results
+
+
+def bench_history(db, devices, windows, repeat):
+    results = []
+    for hours in windows:
+        for device_count in sorted({1, devices}):
+            targets = [f'device-{d}' for d in range(device_count)]
+
+            def query():
+                for device_id in targets:
+                    db.get_hourly_average(device_id, 'temperature', hours)
+
+            results.append({
+                'query': 'get_hourly_average',
+                'hours': hours,
+                'devices': device_count,
+                **time_call(query, repeat)
+            })
+
+    # Raw and minute tier paths
+    for hours, bucket in ((1, 1), (1, 60), (24, 300)):
+        results.append({
+            'query': 'get_history',
+            'hours': hours,
+            'bucket': bucket,
+            'devices': 1,
+            **time_call(lambda: db.get_history('device-0', 'temperature', hours, bucket), repeat)
+        })
+    return results
+
+
+def bench_detections(workdir, records, image_kb, limits, repeat):
+    db = open_db(workdir, 'detections')
+    rng = random.Random(7)
+    for _ in range(records):
+        image = bytes(rng.getrandbits(8) for _ in range(image_kb * 1024))
+        db.save_detection(image, rng.choice(('on-bed', 'off-bed')))
+
+    results = []
+    for limit in limits:
+        results.append({
+            'query': 'get_detection_history',
+            'records': records,
+            'image_kb': image_kb,
+            'limit': limit,
+            **time_call(lambda: db.get_detection_history(limit), repeat)
+        })
+    db.close()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SensorDB benchmark suite')
+    parser.add_argument('--sizes', default='100000,1000000',
+                        help='Comma separated sensor_data row counts')
+    parser.add_argument('--devices', type=int, default=4, help='Devices per database')
+    parser.add_argument('--windows', default='1,24,168', help='History windows in hours')
+    parser.add_argument('--inserts', type=int, default=2000, help='Rows for insert benchmarks')
+    parser.add_argument('--detections', type=int, default=200, help='Detection records')
+    parser.add_argument('--image-kb', type=int, default=50, help='Detection image size')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per query')
+    parser.add_argument('--output', default='bench_results.json', help='JSON output path')
+    parser.add_argument('--workdir', help='Directory for temp databases (default: system temp)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    windows = [int(hours) for hours in args.windows.split(',')]
+    workdir = tempfile.mkdtemp(prefix='sensordb-bench-', dir=args.workdir)
+
+    report = {
+        'meta': {
+            'started_at': datetime.datetime.utcnow().isoformat() + 'Z',
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'args': vars(args)
+        },
+        'insert': None,
+        'history': [],
+        'detections': []
+    }
+
+    try:
+        print(f"[Bench] Insert throughput ({args.inserts} rows)")
+        report['insert'] = bench_inserts(workdir, args.inserts)
+
+        for size in sizes:
+            name = f'history_{size}'
+            db = open_db(workdir, name)
+            print(f"[Bench] Building {size} rows, {args.devices} devices")
+            build = build_sensor_db(db, size, args.devices)
+            build['db_bytes'] = os.path.getsize(db.db_path)
+            print(f"[Bench] Querying {size} rows")
+            report['history'].append({
+                'size': size,
+                'build': build,
+                'results': bench_history(db, args.devices, windows, args.repeat)
+            })
+            db.close()
+            os.remove(db.db_path)
+
+        print(f"[Bench] Detection history ({args.detections} x {args.image_kb} KB)")
+        report['detections'] = bench_detections(
+            workdir, args.detections, args.image_kb, (10, 100), args.repeat
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"[Bench] Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,417 @@
+"""
+WebsocketServer load generator
+
+Simulates many ESP32 clients on one asyncio loop. Each device registers,
+streams readings at a fixed rate and answers led_command messages with a
+command_ack, exactly like the sketch in Iot/esp32alarm. A monitor connection
+subscribes to the "sensor" topic to time each reading from device send to
+the server's broadcast (this is before the sink queue and the database
+write), and commands are fanned out through the /api/command endpoint to
+time the round trip.
+
+    python bench_websocket.py --spawn --devices 2000 --rate 1 --duration 60
+    python bench_websocket.py --url ws://localhost:5501 --api-url http://localhost:5000 \\
+        --server-pid $(pgrep -f server.py)
+
+--spawn starts a WebsocketServer in a child process (with a small HTTP
+/api/command endpoint) so its memory can be sampled on its own. Its sink
+queue lag and, with --with-db, SensorDB flush stats are added to the report
+as the rest of the ingest path.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import websockets
+
+from bench_sensor_db import git_revision, summarize
+
+SENSORS = ('temperature', 'humidity')
+
+
+class LoadStats:
+
+    def __init__(self):
+        self.connected = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+        self.messages_sent = 0
+        self.readings_sent = 0
+        self.readings_seen = 0
+        self.commands_received = 0
+        # (device_id, sequence) -> perf_counter at send, removed when the
+        # reading comes back on the monitor connection
+        self.in_flight = {}
+        self.broadcast_ms = []
+        self.command_ms = []
+        self.command_http_ms = []
+        self.command_status = {}
+        self.rss_kb = []
+
+
+def read_rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def raise_open_file_limit():
+    # Every simulated device is a socket
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ImportError, ValueError, OSError):
+        return None
+
+
+async def run_device(device_id, args, stats, stop_at):
+    try:
+        websocket = await websockets.connect(args.url, max_size=None)
+    except Exception:
+        stats.connect_failures += 1
+        return
+
+    async def receive():
+        async for message in websocket:
+            data = json.loads(message)
+            if data.get('msg_type') == 'led_command':
+                stats.commands_received += 1
+                if 'cmd_id' in data:
+                    await websocket.send(json.dumps({
+                        'msg_type': 'command_ack',
+                        'device_id': device_id,
+                        'cmd_id': data['cmd_id'],
+                        'status': 'ok'
+                    }))
+
+    receiver = None
+    try:
+        await websocket.send(json.dumps({'msg_type': 'register', 'device_id': device_id}))
+        json.loads(await websocket.recv())  # registration_ack
+        stats.connected += 1
+        receiver = asyncio.create_task(receive())
+
+        interval = args.batch / args.rate if args.batch else 1.0 / args.rate
+        # Spread devices over one interval so they don't send in lockstep
+        await asyncio.sleep(random.uniform(0, interval))
+        sequence = 0
+        while time.monotonic() < stop_at:
+            readings = []
+            for _ in range(args.batch or 1):
+                sequence += 1
+                # The value carries the sequence number so the monitor can
+                # match the broadcast back to this send
+                readings.append((SENSORS[sequence % len(SENSORS)], float(sequence)))
+                stats.in_flight[(device_id, float(sequence))] = time.perf_counter()
+
+            if args.batch:
+                millis = int(time.monotonic() * 1000)
+                message = {
+                    'msg_type': 'sensor_batch',
+                    'device_id': device_id,
+                    'now': millis,
+                    'readings': [[sensor_id, millis, value] for sensor_id, value in readings]
+                }
+            else:
+                sensor_id, value = readings[0]
+                message = {
+                    'msg_type': 'sensor_data',
+                    'device_id': device_id,
+                    'sensor_id': sensor_id,
+                    'value': value
+                }
+            await websocket.send(json.dumps(message))
+            stats.messages_sent += 1
+            stats.readings_sent += len(readings)
+            await asyncio.sleep(interval)
+    except websockets.ConnectionClosed:
+        stats.disconnects += 1
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        await websocket.close()
+
+
+async def run_monitor(args, stats, ready):
+    async with websockets.connect(args.url, max_size=None) as websocket:
+        await websocket.send(json.dumps({'msg_type': 'subscribe', 'topics': ['sensor']}))
+        ready.set()
+        async for message in websocket:
+            received = time.perf_counter()
+            data = json.loads(message)
+            if data.get('topic') != 'sensor':
+                continue
+            sent = stats.in_flight.pop((data.get('device_id'), data.get('value')), None)
+            if sent is not None:
+                stats.readings_seen += 1
+                stats.broadcast_ms.append((received - sent) * 1000)
+
+
+def post_command(api_url, targets, timeout):
+    body = json.dumps({'targets': targets, 'value': 'toggle', 'timeout': timeout}).encode()
+    request = urllib.request.Request(
+        api_url.rstrip('/') + '/api/command',
+        data=body,
+        headers={'Content-Type': 'application/json'}
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=timeout + 5) as response:
+        result = json.loads(response.read())
+    return (time.perf_counter() - start) * 1000, result
+
+
+async def run_commands(args, stats, device_ids, stop_at):
+    loop = asyncio.get_running_loop()
+    while time.monotonic() < stop_at:
+        await asyncio.sleep(args.command_interval)
+        targets = random.sample(device_ids, min(args.command_targets, len(device_ids)))
+        try:
+            http_ms, result = await loop.run_in_executor(
+                None, post_command, args.api_url, targets, args.command_timeout
+            )
+        except Exception as e:
+            print(f"[Bench] Command request failed: {e}")
+            continue
+        stats.command_http_ms.append(http_ms)
+        for device_result in result.get('results', {}).values():
+            status = device_result['status']
+            stats.command_status[status] = stats.command_status.get(status, 0) + 1
+            if device_result.get('latency_ms') is not None:
+                stats.command_ms.append(device_result['latency_ms'])
+
+
+async def sample_memory(pid, stats, stop_at):
+    while time.monotonic() < stop_at:
+        rss = read_rss_kb(pid)
+        if rss is not None:
+            stats.rss_kb.append(rss)
+        await asyncio.sleep(1)
+
+
+async def run_load(args, stats, server_pid):
+    device_ids = [f'sim-{i:05d}' for i in range(args.devices)]
+    ready = asyncio.Event()
+    monitor = asyncio.create_task(run_monitor(args, stats, ready))
+    await asyncio.wait_for(ready.wait(), 10)
+
+    stop_at = time.monotonic() + args.ramp + args.duration
+    background = []
+    if server_pid:
+        background.append(asyncio.create_task(sample_memory(server_pid, stats, stop_at)))
+
+    devices = []
+    ramp_start = time.monotonic()
+    for index, device_id in enumerate(device_ids):
+        devices.append(asyncio.create_task(run_device(device_id, args, stats, stop_at)))
+        if args.ramp:
+            delay = ramp_start + args.ramp * (index + 1) / len(device_ids) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+    print(f"[Bench] {stats.connected} devices connected, {stats.connect_failures} failed")
+
+    # Only the steady state after ramp-up counts towards throughput
+    stats.broadcast_ms.clear()
+    counters = (stats.messages_sent, stats.readings_sent, stats.readings_seen)
+    steady_start = time.monotonic()
+    if args.api_url:
+        background.append(asyncio.create_task(run_commands(args, stats, device_ids, stop_at)))
+
+    await asyncio.gather(*devices)
+    elapsed = time.monotonic() - steady_start
+    # Give readings still in the pipeline a moment to arrive
+    await asyncio.sleep(1)
+    monitor.cancel()
+    for task in background:
+        task.cancel()
+
+    return {
+        'elapsed_seconds': round(elapsed, 2),
+        'messages_per_second': round((stats.messages_sent - counters[0]) / elapsed, 1),
+        'readings_per_second': round((stats.readings_sent - counters[1]) / elapsed, 1),
+        'readings_seen_per_second': round((stats.readings_seen - counters[2]) / elapsed, 1)
+    }
+
+
+def build_report(args, stats, throughput, limit, server_stats=None):
+    return {
+        'meta': {
+            'started_at': datetime.datetime.utcnow().isoformat() + 'Z',
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'open_file_limit': limit,
+            'args': vars(args)
+        },
+        'connections': {
+            'devices': args.devices,
+            'connected': stats.connected,
+            'connect_failures': stats.connect_failures,
+            'disconnects': stats.disconnects
+        },
+        'throughput': throughput,
+        # Device send -> broadcast to subscribers; sink and DB are in server_stats
+        'broadcast_latency': summarize(stats.broadcast_ms) if stats.broadcast_ms else None,
+        'readings_lost': len(stats.in_flight),
+        'commands': {
+            'received_by_devices': stats.commands_received,
+            'status': stats.command_status,
+            'round_trip': summarize(stats.command_ms) if stats.command_ms else None,
+            'http': summarize(stats.command_http_ms) if stats.command_http_ms else None
+        },
+        'server_memory': {
+            'start_kb': stats.rss_kb[0],
+            'peak_kb': max(stats.rss_kb),
+            'end_kb': stats.rss_kb[-1]
+        } if stats.rss_kb else None,
+        'server_stats': server_stats
+    }
+
+
+def serve(args):
+    # Child process for --spawn: the WebSocket server plus just enough HTTP to
+    # fan out commands, without Flask or the camera loop.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from websocket_server import WebsocketServer
+
+    sinks = {}
+    db = None
+    if args.db_dir:
+        from sensor_db import SensorDB
+        db = SensorDB(os.path.join(args.db_dir, 'load.db'),
+                      image_dir=os.path.join(args.db_dir, 'images'))
+        sinks = {
+            'on_sensor_data': db.insert_sensor_data,
+            'on_sensor_batch': db.insert_sensor_batch
+        }
+    ws_server = WebsocketServer(port=args.port, **sinks)
+    ws_server.start_in_thread()
+
+    class CommandHandler(BaseHTTPRequestHandler):
+
+        def _send_json(self, data):
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            results = ws_server.send_command(
+                data['targets'], data['value'], float(data.get('timeout', 2.0))
+            )
+            self._send_json({'status': 'success', 'results': results})
+
+        def do_GET(self):
+            # /stats: sink queue lag and DB flushes, the part of ingest the
+            # monitor connection can't see
+            self._send_json({
+                'sink': ws_server.get_sink_stats(),
+                'db': db.get_write_stats() if db else None
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer(('127.0.0.1', args.api_port), CommandHandler).serve_forever()
+
+
+def spawn_server(args, workdir):
+    command = [sys.executable, os.path.abspath(__file__), '--serve',
+               '--port', str(args.port), '--api-port', str(args.api_port)]
+    if args.with_db:
+        command += ['--db-dir', workdir]
+    # Readings aren't printed by default, so the server's output stays small
+    process = subprocess.Popen(command)
+    time.sleep(2)
+    if process.poll() is not None:
+        raise RuntimeError('Spawned server exited during startup')
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebsocketServer load generator')
+    parser.add_argument('--url', default='ws://localhost:5501', help='WebSocket server URL')
+    parser.add_argument('--api-url', help='HTTP base URL with /api/command for command timing')
+    parser.add_argument('--server-pid', type=int, help='Server PID to sample memory from')
+    parser.add_argument('--spawn', action='store_true',
+                        help='Start a server in a child process on --port/--api-port')
+    parser.add_argument('--port', type=int, default=5601, help='WebSocket port for --spawn')
+    parser.add_argument('--api-port', type=int, default=5602, help='HTTP port for --spawn')
+    parser.add_argument('--with-db', action='store_true',
+                        help='With --spawn, write readings to a temporary SensorDB')
+    parser.add_argument('--devices', type=int, default=500, help='Simulated devices')
+    parser.add_argument('--rate', type=float, default=1.0, help='Readings per second per device')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='Readings per sensor_batch message (0 sends sensor_data)')
+    parser.add_argument('--ramp', type=float, default=10.0, help='Seconds to connect all devices')
+    parser.add_argument('--duration', type=float, default=30.0, help='Steady-state seconds')
+    parser.add_argument('--command-interval', type=float, default=2.0,
+                        help='Seconds between command fan-outs')
+    parser.add_argument('--command-targets', type=int, default=10, help='Devices per command')
+    parser.add_argument('--command-timeout', type=float, default=2.0, help='Ack timeout')
+    parser.add_argument('--output', default='ws_bench_results.json', help='JSON output path')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--db-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    limit = raise_open_file_limit()
+    if limit is not None and limit < args.devices + 100:
+        print(f"[Bench] Open file limit {limit} is below {args.devices} devices")
+
+    workdir = tempfile.mkdtemp(prefix='ws-bench-')
+    process = None
+    server_pid = args.server_pid
+    if args.spawn:
+        args.url = f'ws://127.0.0.1:{args.port}'
+        args.api_url = f'http://127.0.0.1:{args.api_port}'
+        process = spawn_server(args, workdir)
+        server_pid = process.pid
+
+    stats = LoadStats()
+    server_stats = None
+    try:
+        print(f"[Bench] {args.devices} devices at {args.rate}/s against {args.url}")
+        throughput = asyncio.run(run_load(args, stats, server_pid))
+        if process is not None:
+            with urllib.request.urlopen(f'{args.api_url}/stats', timeout=10) as response:
+                server_stats = json.loads(response.read())
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = build_report(args, stats, throughput, limit, server_stats)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"[Bench] {throughput['readings_per_second']} readings/s, "
+          f"broadcast p95 {report['broadcast_latency'] and report['broadcast_latency']['p95_ms']} ms")
+    print(f"[Bench] Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+
+class CameraService:
+    """Keeps the camera open in a background thread and holds the latest
+    frame, so callers never pay the open/negotiate/warm-up cost.
+
+    Frames are double-buffered: the thread reads into the back buffer and
+    swaps it to the front. Readers borrow the front buffer through frame()
+    without a copy. If a reader still holds a buffer when it would be
+    reused, the thread reads into a fresh array instead, so a borrowed
+    frame never changes underneath its reader.
+    """
+
+    def __init__(
+        self,
+        indices: Sequence[int] = (0, 1),
+        width: int = 640,
+        height: int = 480,
+        reconnect_delay: float = 2.0,
+        max_failures: int = 5
+    ):
+        self.indices = indices
+        self.width = width
+        self.height = height
+        self.reconnect_delay = reconnect_delay
+        self.max_failures = max_failures
+
+        self._buffers = [None, None]
+        self._readers = [0, 0]
+        self._front = 0
+        self._timestamp = 0.0
+        self._sequence = 0
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.stats = {
+            'frames': 0,
+            'read_failures': 0,
+            'open_failures': 0,
+            'reconnects': 0,
+            'contended_reads': 0,
+            'connected': False,
+            'device_index': None
+        }
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _open(self) -> Optional[cv2.VideoCapture]:
+        for index in self.indices:
+            cap = cv2.VideoCapture(index)
+            if cap.isOpened():
+                cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+                # Only the newest frame matters; a deep driver queue would
+                # hand out stale ones
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                self.stats['device_index'] = index
+                return cap
+            cap.release()
+        return None
+
+    def _read_frames(self, cap: cv2.VideoCapture) -> None:
+        failures = 0
+        while not self._stop_event.is_set():
+            with self._cond:
+                back = 1 - self._front
+                buffer = self._buffers[back] if self._readers[back] == 0 else None
+                if buffer is None and self._buffers[back] is not None:
+                    self.stats['contended_reads'] += 1
+
+            ret, frame = cap.read(buffer) if buffer is not None else cap.read()
+            if not ret:
+                failures += 1
+                self.stats['read_failures'] += 1
+                if failures >= self.max_failures:
+                    return
+                time.sleep(0.05)
+                continue
+            failures = 0
+
+            with self._cond:
+                self._buffers[back] = frame
+                self._front = back
+                self._timestamp = time.time()
+                self._sequence += 1
+                self.stats['frames'] += 1
+                self._cond.notify_all()
+
+    def _capture_loop(self) -> None:
+        while not self._stop_event.is_set():
+            cap = self._open()
+            if cap is None:
+                self.stats['open_failures'] += 1
+                print(f"[Camera] Failed to open camera, retrying in {self.reconnect_delay}s")
+                self._stop_event.wait(self.reconnect_delay)
+                continue
+
+            print(f"[Camera] Opened camera {self.stats['device_index']}")
+            self.stats['connected'] = True
+            try:
+                self._read_frames(cap)
+            finally:
+                cap.release()
+                self.stats['connected'] = False
+            if not self._stop_event.is_set():
+                self.stats['reconnects'] += 1
+                print("[Camera] Lost camera, reconnecting")
+                self._stop_event.wait(self.reconnect_delay)
+
+    @contextmanager
+    def frame(self, newer_than: Optional[float] = None,
+              timeout: float = 2.0) -> Iterator[Tuple[np.ndarray, float]]:
+        """Borrow the latest frame as (frame, timestamp).
+
+        The array is shared: don't modify it or keep it after the with
+        block; copy it if it has to outlive the block. newer_than waits for
+        a frame captured at or after that time.time() value.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._sequence == 0 or (newer_than is not None and self._timestamp < newer_than):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("No camera frame available")
+                self._cond.wait(remaining)
+            index = self._front
+            self._readers[index] += 1
+            frame, timestamp = self._buffers[index], self._timestamp
+        try:
+            yield frame, timestamp
+        finally:
+            with self._cond:
+                self._readers[index] -= 1
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        with self._cond:
+            stats['last_frame_age'] = (
+                round(time.time() - self._timestamp, 3) if self._sequence else None
+            )
+        return stats
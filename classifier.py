@@ -1,30 +1,112 @@
 import cv2
 import numpy as np
 import os
-import joblib
+import threading
+from model_registry import get_registry
+
+IMAGE_SIZE = (128, 128)
+CANNY_THRESHOLDS = (100, 200)
+
+
+class FeaturePipeline:
+    """grayscale -> 128x128 -> Canny -> HOG. The descriptor and the feature
+    size are set up once; only the intermediate buffers are per thread and
+    reused for each frame.
+    """
+
+    def __init__(self, image_size=IMAGE_SIZE, canny_thresholds=CANNY_THRESHOLDS):
+        self.image_size = image_size
+        self.canny_thresholds = canny_thresholds
+        # compute() doesn't modify the descriptor, so threads share it
+        self.hog = cv2.HOGDescriptor()
+        width, height = image_size
+        self.dim = self.hog.compute(np.zeros((height, width), np.uint8)).size
+        self._local = threading.local()
+
+    def _state(self):
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            width, height = self.image_size
+            state = self._local.state = {
+                'gray': None,
+                'resized': np.empty((height, width), np.uint8),
+                'edges': np.empty((height, width), np.uint8),
+                'batch': None
+            }
+        return state
+
+    def spec(self):
+        # Stored with exported models so a model can be checked against the
+        # features it is fed
+        return {
+            'image_size': list(self.image_size),
+            'canny_thresholds': list(self.canny_thresholds),
+            'descriptor': 'opencv-hog-default',
+            'dim': self.dim
+        }
+
+    def _extract_into(self, state, image, out):
+        if image.ndim == 3:
+            gray = state['gray']
+            if gray is None or gray.shape != image.shape[:2]:
+                gray = state['gray'] = np.empty(image.shape[:2], np.uint8)
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+        else:
+            gray = image
+        cv2.resize(gray, self.image_size, dst=state['resized'])
+        cv2.Canny(state['resized'], *self.canny_thresholds, edges=state['edges'])
+        out[:] = self.hog.compute(state['edges']).ravel()
+
+    def extract(self, image):
+        state = self._state()
+        features = np.empty((1, self.dim), np.float32)
+        self._extract_into(state, image, features[0])
+        return features
+
+    def extract_batch(self, images, reuse=False):
+        # One (n, dim) float32 matrix. With reuse=True the matrix is this
+        # thread's scratch buffer and is only valid until the next call.
+        state = self._state()
+        count = len(images)
+        if reuse:
+            batch = state['batch']
+            if batch is None or batch.shape[0] < count:
+                batch = state['batch'] = np.empty((count, self.dim), np.float32)
+            features = batch[:count]
+        else:
+            features = np.empty((count, self.dim), np.float32)
+        for row, image in zip(features, images):
+            self._extract_into(state, image, row)
+        return features
+
 
 class Classifier:
-    def __init__(self):
-        try:
-            self.svm = joblib.load('svm_model.pkl')
-        except Exception as e:
-            print(f"Error loading model: {e} model not found")
-            self.svm = None
+    def __init__(self, model_path='svm_model.pkl'):
+        # The model itself lives in the process-wide registry, so creating a
+        # Classifier is cheap and every instance sees hot reloads
+        self.registry = get_registry(model_path)
+        self.registry.get()
+        self.pipeline = FeaturePipeline()
 
-    def classify(self, image):
-        # convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        # resize to 128x128
-        resized = cv2.resize(gray, (128, 128))
-        # canny edge detection
-        edges = cv2.Canny(resized, 100, 200)
-        # hog descriptor
-        hog = cv2.HOGDescriptor()
-        hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
-        features = hog.compute(edges).flatten().reshape(1, -1)
-        result = self.svm.predict(features)[0]
+    @property
+    def svm(self):
+        current = self.registry.get()
+        return current.model if current else None
+
+    @staticmethod
+    def _label(result):
         if result == 1:
             return 'on-bed'
         else:
             return 'off-bed'
-            
+
+    def classify(self, image):
+        return self.classify_batch([image])[0]
+
+    def classify_batch(self, frames):
+        # Features for every frame go into one matrix and the model is
+        # called once, so per-call overhead is paid once per batch
+        if len(frames) == 0:
+            return []
+        features = self.pipeline.extract_batch(frames, reuse=True)
+        return [self._label(result) for result in self.svm.predict(features)]
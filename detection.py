@@ -3,6 +3,7 @@ import numpy as np
 import os
 import joblib
 from classifier import Classifier
+from camera_service import CameraService
 from train import extract_hog_feature
 from sklearn import svm
 from datetime import datetime
@@ -23,23 +24,18 @@ os.makedirs(feedback_dir, exist_ok=True)
 os.makedirs(os.path.join(feedback_dir, 'on-bed'), exist_ok=True)
 os.makedirs(os.path.join(feedback_dir, 'off-bed'), exist_ok=True)
 
-# open camera
-cap = cv2.VideoCapture(0)
+# open camera (索引 0, 失敗時改用 1; 背景執行緒會自動重新連線)
+camera = CameraService(indices=(0, 1), width=640, height=480)
+camera.start()
 
-if not cap.isOpened():
-    print("無法開啟攝影機,嘗試使用其他索引...")
-    cap = cv2.VideoCapture(1)
-    if not cap.isOpened():
-        print("仍然無法開啟攝影機")
-        exit()
-
-# 設定攝影機屬性
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
-# 等待攝影機初始化
-import time
-time.sleep(2)
+# 等待第一張影像,不再固定等待 2 秒
+try:
+    with camera.frame(timeout=10.0):
+        pass
+except TimeoutError:
+    print("仍然無法開啟攝影機")
+    camera.stop()
+    exit()
 
 print("=" * 60)
 print("攝影機已開啟 - 實時 Feedback Training 模式")
@@ -111,12 +107,10 @@ def retrain_model():
     joblib.dump(classifier.svm, backup_path)
     print(f"✓ 原始模型已備份至: {backup_path}")
     
-    joblib.dump(new_model, 'svm_model.pkl')
+    # 原子寫入並切換 registry 中的模型 (舊版本保留以便 rollback)
+    version = classifier.registry.publish(new_model)
     print("✓ 新模型已儲存至: svm_model.pkl")
-    
-    # 重新載入模型到 classifier
-    classifier.svm = new_model
-    print("✓ 模型已更新")
+    print(f"✓ 模型已更新 (版本 {version.version})")
     
     print("=" * 60)
     print("重新訓練完成！")
@@ -144,16 +138,19 @@ def show_stats():
 
 frame_count = 0
 current_frame = None
+last_timestamp = 0.0
 
 while True:
-    ret, frame = cap.read()
-    if not ret:
+    # 只處理新影像; 畫面上要疊字,所以複製一份共享的影像
+    try:
+        with camera.frame(newer_than=last_timestamp + 1e-6, timeout=1.0) as (shared, last_timestamp):
+            frame = shared.copy()
+    except TimeoutError:
         frame_count += 1
         if frame_count > 5:
             print("連續無法讀取影像,退出程式")
             break
         print(f"無法讀取影像 (嘗試 {frame_count}/5)")
-        time.sleep(0.5)
         continue
     
     frame_count = 0  # 重置計數器
@@ -201,7 +198,7 @@ while True:
         # 顯示統計
         show_stats()
 
-cap.release()
+camera.stop()
 cv2.destroyAllWindows()
 
 # 程式結束時顯示最終統計
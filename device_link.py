@@ -0,0 +1,151 @@
+import time
+from typing import Dict, Optional
+
+
+class DeviceLink:
+    # One of these per device ever seen, so keep them small: fixed slots
+    # and plain numbers, no per-message history.
+    __slots__ = (
+        'device_id', 'connected', 'connects', 'connected_at', 'disconnected_at',
+        'last_seen', 'messages_in', 'bytes_in', 'messages_out', 'bytes_out',
+        'rate', '_rate_start', '_rate_count',
+        'rtt_ms', 'rtt_avg_ms', 'missed_pongs', 'evictions',
+        'commands', 'command_failures', 'command_avg_ms', 'command_max_ms',
+        'throttled', 'oversized'
+    )
+
+    # Messages per second is recomputed once per window
+    RATE_WINDOW = 10.0
+    # Weight of the newest sample in the RTT and command latency averages
+    SMOOTHING = 0.2
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.connected = False
+        self.connects = 0
+        self.connected_at = None
+        self.disconnected_at = None
+        self.last_seen = None
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.messages_out = 0
+        self.bytes_out = 0
+        self.rate = 0.0
+        self._rate_start = time.monotonic()
+        self._rate_count = 0
+        self.rtt_ms = None
+        self.rtt_avg_ms = None
+        self.missed_pongs = 0
+        self.evictions = 0
+        self.commands = 0
+        self.command_failures = 0
+        self.command_avg_ms = None
+        self.command_max_ms = 0.0
+        self.throttled = 0
+        self.oversized = 0
+
+    def _smooth(self, average: Optional[float], sample: float) -> float:
+        if average is None:
+            return sample
+        return average + self.SMOOTHING * (sample - average)
+
+    def on_connect(self) -> None:
+        self.connected = True
+        self.connects += 1
+        self.connected_at = time.time()
+        self.last_seen = self.connected_at
+        self.missed_pongs = 0
+
+    def on_disconnect(self) -> None:
+        self.connected = False
+        self.disconnected_at = time.time()
+
+    def on_message_in(self, size: int) -> None:
+        self.last_seen = time.time()
+        self.messages_in += 1
+        self.bytes_in += size
+        self._rate_count += 1
+        now = time.monotonic()
+        elapsed = now - self._rate_start
+        if elapsed >= self.RATE_WINDOW:
+            self.rate = self._rate_count / elapsed
+            self._rate_start = now
+            self._rate_count = 0
+
+    def on_message_out(self, size: int) -> None:
+        self.messages_out += 1
+        self.bytes_out += size
+
+    def on_pong(self, rtt_ms: float) -> None:
+        self.last_seen = time.time()
+        self.rtt_ms = rtt_ms
+        self.rtt_avg_ms = self._smooth(self.rtt_avg_ms, rtt_ms)
+        self.missed_pongs = 0
+
+    def on_command(self, latency_ms: Optional[float]) -> None:
+        # None means the command was not acknowledged
+        self.commands += 1
+        if latency_ms is None:
+            self.command_failures += 1
+            return
+        self.command_avg_ms = self._smooth(self.command_avg_ms, latency_ms)
+        self.command_max_ms = max(self.command_max_ms, latency_ms)
+
+    def messages_per_second(self) -> float:
+        # A device that went quiet would otherwise keep its last rate forever
+        elapsed = time.monotonic() - self._rate_start
+        if elapsed >= self.RATE_WINDOW:
+            return self._rate_count / elapsed
+        return self.rate
+
+    def to_dict(self) -> Dict:
+        def rounded(value):
+            return None if value is None else round(value, 3)
+
+        return {
+            'device_id': self.device_id,
+            'connected': self.connected,
+            'connected_at': self.connected_at,
+            'disconnected_at': self.disconnected_at,
+            'last_seen': self.last_seen,
+            'reconnects': max(0, self.connects - 1),
+            'evictions': self.evictions,
+            'messages_in': self.messages_in,
+            'bytes_in': self.bytes_in,
+            'messages_out': self.messages_out,
+            'bytes_out': self.bytes_out,
+            'messages_per_second': round(self.messages_per_second(), 3),
+            'rtt_ms': rounded(self.rtt_ms),
+            'rtt_avg_ms': rounded(self.rtt_avg_ms),
+            'missed_pongs': self.missed_pongs,
+            'commands': self.commands,
+            'command_failures': self.command_failures,
+            'command_avg_ms': rounded(self.command_avg_ms),
+            'command_max_ms': round(self.command_max_ms, 3),
+            'throttled': self.throttled,
+            'oversized': self.oversized
+        }
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    def charge(self, cost: float) -> None:
+        # For costs only known after parsing (readings in a batch); the
+        # bucket may go negative and later messages pay off the debt
+        self.tokens -= cost
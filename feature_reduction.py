@@ -0,0 +1,39 @@
+"""
+Optional dimensionality reduction for HOG features
+
+The default HOG descriptor turns a 128x128 edge image into 34020 features.
+make_model() puts a PCA or sparse random projection stage in front of the
+linear SVM so training, the pickled model and kernel evaluation work in a
+much smaller space. The stage is part of the sklearn Pipeline, so it is
+fit in training, saved in the same pickle and applied by predict(); the
+.npz export folds it into the weights (see linear_model.from_sklearn).
+
+bench_reduction.py reports accuracy and latency for a range of sizes.
+"""
+from typing import Optional
+
+from sklearn.decomposition import PCA
+from sklearn.pipeline import make_pipeline
+from sklearn.random_projection import SparseRandomProjection
+from sklearn.svm import SVC
+
+REDUCTION_METHODS = ('pca', 'random')
+
+
+def make_reducer(method: str, dim: int, random_state: int = 0):
+    if method == 'pca':
+        # PCA can keep at most min(n_samples, n_features) components
+        return PCA(n_components=dim, svd_solver='randomized', random_state=random_state)
+    if method == 'random':
+        # Sparse +-1 entries: cheap to apply and to store, no fitting cost
+        return SparseRandomProjection(n_components=dim, dense_output=True,
+                                      random_state=random_state)
+    raise ValueError(f"Unknown reduction method: {method} (expected one of {REDUCTION_METHODS})")
+
+
+def make_model(method: Optional[str] = None, dim: Optional[int] = None, random_state: int = 0):
+    # Linear SVM, optionally behind a reduction stage
+    svm = SVC(kernel='linear')
+    if method is None:
+        return svm
+    return make_pipeline(make_reducer(method, dim, random_state), svm)
@@ -0,0 +1,468 @@
+"""
+Multi-process WebSocket gateway
+
+Several worker processes each run a WebsocketServer on the same port with
+SO_REUSEPORT, so the kernel spreads device connections across cores. Each
+worker records the devices it owns in a shared SQLite registry and answers
+requests on a Unix socket. GatewayClient is used by the Flask process in
+place of a WebsocketServer: it looks up the owning worker in the registry
+and forwards commands and buffer reads to it.
+
+IPC is one JSON line per request and one JSON line back:
+
+    {"op": "command", "device_ids": [...], "value": "on", "timeout": 2.0}
+
+Browser subscriptions land on any worker too, so each worker relays the
+events it publishes (readings, device status) to its peers over a
+long-lived {"op": "relay"} connection, one {"events": [...]} line per batch.
+
+Workers are started as `python gateway.py <worker_id> <config json>`, so
+they import only this module and its dependencies, never the parent's
+main module (server.py and its camera, model and database globals).
+"""
+import atexit
+import asyncio
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sensor_db import SensorDB
+from websocket_server import WebsocketServer, resolve_targets
+
+
+class DeviceRegistry:
+    """device_id -> owning worker, shared by every process on the host"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._get_connection()
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS gateway_devices (
+                device_id TEXT PRIMARY KEY,
+                worker_id INTEGER NOT NULL,
+                connected_at INTEGER NOT NULL
+            )
+        ''')
+        conn.commit()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=5.0)
+        return conn
+
+    def register(self, device_id: str, worker_id: int) -> None:
+        # A device that reconnects to another worker simply moves
+        conn = self._get_connection()
+        conn.execute('''
+            INSERT INTO gateway_devices (device_id, worker_id, connected_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(device_id) DO UPDATE SET
+                worker_id = excluded.worker_id,
+                connected_at = excluded.connected_at
+        ''', (device_id, worker_id, int(time.time())))
+        conn.commit()
+
+    def unregister(self, device_id: str, worker_id: int) -> None:
+        conn = self._get_connection()
+        conn.execute(
+            'DELETE FROM gateway_devices WHERE device_id = ? AND worker_id = ?',
+            (device_id, worker_id)
+        )
+        conn.commit()
+
+    def clear_worker(self, worker_id: int) -> None:
+        # Rows left behind by a worker that crashed or restarted
+        conn = self._get_connection()
+        conn.execute('DELETE FROM gateway_devices WHERE worker_id = ?', (worker_id,))
+        conn.commit()
+
+    def owners(self, device_ids: List[str]) -> Dict[str, int]:
+        if not device_ids:
+            return {}
+        placeholders = ','.join('?' * len(device_ids))
+        rows = self._get_connection().execute(
+            f'SELECT device_id, worker_id FROM gateway_devices WHERE device_id IN ({placeholders})',
+            list(device_ids)
+        ).fetchall()
+        return dict(rows)
+
+    def devices(self) -> List[str]:
+        rows = self._get_connection().execute(
+            'SELECT device_id FROM gateway_devices ORDER BY device_id'
+        ).fetchall()
+        return [row[0] for row in rows]
+
+
+def socket_path(socket_dir: str, worker_id: int) -> str:
+    return os.path.join(socket_dir, f'worker-{worker_id}.sock')
+
+
+class GatewayWorker:
+
+    # Events buffered per peer worker, and the most sent in one IPC line
+    RELAY_QUEUE_SIZE = 10000
+    RELAY_BATCH = 500
+
+    def __init__(self, worker_id: int, config: Dict):
+        self.worker_id = worker_id
+        self.config = config
+        self.ipc_server = None
+        self.registry = DeviceRegistry(config['registry_path'])
+        self.registry.clear_worker(worker_id)
+        self.sensor_db = SensorDB(config['db_path'], image_dir=config['image_dir'],
+                                  compression=config.get('compression'))
+        # Browsers subscribe on whichever worker the kernel picks, so every
+        # event published here is relayed to the other workers
+        self.relay_queues = {}
+        self.relay_stats = {'relayed': 0, 'dropped': 0}
+        self.ws_server = WebsocketServer(
+            host=config['host'],
+            port=config['port'],
+            on_sensor_data=self.sensor_db.insert_sensor_data,
+            on_sensor_batch=self.sensor_db.insert_sensor_batch,
+            groups=config.get('groups'),
+            reuse_port=True,
+            log_readings=config.get('log_readings', False),
+            on_publish=self._relay,
+            on_register=lambda device_id: self.registry.register(device_id, worker_id),
+            on_unregister=lambda device_id: self.registry.unregister(device_id, worker_id)
+        )
+
+    async def _handle_request(self, request: Dict):
+        ws = self.ws_server
+        op = request['op']
+        if op == 'command':
+            return await ws.send_command_async(
+                request['device_ids'], request['value'], request['timeout']
+            )
+        if op == 'publish':
+            # Already sent to every worker by GatewayClient.publish
+            ws.publish(request['topic'], request['payload'], local=True)
+            return True
+        if op == 'sensor_data':
+            return ws.get_sensor_data(request['device_id'])
+        if op == 'recent_readings':
+            return ws.get_recent_readings(
+                request['device_id'], request['sensor_id'], request['seconds']
+            )
+        if op == 'recent_stats':
+            return ws.get_recent_stats(
+                request['device_id'], request['sensor_id'], request['seconds']
+            )
+        if op == 'buffered_history':
+            return ws.get_buffered_history(
+                request['device_id'], request['sensor_id'], request['hours'],
+                request['bucket'], request['tz_offset']
+            )
+        if op == 'device_stats':
+            return ws.get_device_stats()
+        if op == 'stats':
+            return {
+                'devices': len(ws.device_map),
+                'sink_stats': ws.get_sink_stats(),
+                'relay_stats': dict(self.relay_stats),
+                'write_stats': self.sensor_db.get_write_stats()
+            }
+        raise ValueError(f"Unknown gateway op: {op}")
+
+    def _relay(self, topic, payload):
+        # Called on the worker loop for every event published here. Live
+        # events are best effort: a peer that can't keep up loses events
+        # instead of holding up this worker.
+        for queue in self.relay_queues.values():
+            if queue.full():
+                self.relay_stats['dropped'] += 1
+            else:
+                queue.put_nowait((topic, payload))
+
+    async def _relay_to(self, peer_id: int, queue: asyncio.Queue):
+        # One long-lived connection per peer; events are sent in batches of
+        # whatever queued up while the previous batch was written
+        writer = None
+        while True:
+            events = [await queue.get()]
+            while not queue.empty() and len(events) < self.RELAY_BATCH:
+                events.append(queue.get_nowait())
+            try:
+                if writer is None:
+                    _, writer = await asyncio.open_unix_connection(
+                        socket_path(self.config['socket_dir'], peer_id))
+                    writer.write(json.dumps({'op': 'relay'}).encode() + b'\n')
+                writer.write(json.dumps({'events': events}).encode() + b'\n')
+                await writer.drain()
+                self.relay_stats['relayed'] += len(events)
+            except OSError:
+                # Peer not up yet or restarting; reconnect on the next batch
+                self.relay_stats['dropped'] += len(events)
+                if writer is not None:
+                    writer.close()
+                writer = None
+
+    async def _receive_relay(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            for topic, payload in json.loads(line)['events']:
+                self.ws_server.publish(topic, payload, local=True)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            line = await reader.readline()
+            try:
+                request = json.loads(line)
+                if request['op'] == 'relay':
+                    # A peer worker's event stream; no response
+                    await self._receive_relay(reader)
+                    return
+                response = {'ok': True, 'result': await self._handle_request(request)}
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _serve_ipc(self):
+        path = socket_path(self.config['socket_dir'], self.worker_id)
+        if os.path.exists(path):
+            os.remove(path)
+        self.ipc_server = await asyncio.start_unix_server(self._handle_connection, path)
+        for peer_id in range(self.config['workers']):
+            if peer_id != self.worker_id:
+                queue = self.relay_queues[peer_id] = asyncio.Queue(maxsize=self.RELAY_QUEUE_SIZE)
+                asyncio.create_task(self._relay_to(peer_id, queue))
+
+    def run(self):
+        print(f"[Gateway] Worker {self.worker_id} (pid {os.getpid()}) starting")
+        self.ws_server.start_in_thread()
+        # IPC runs on the WebSocket loop so commands go straight to the sockets
+        while self.ws_server.loop is None or not self.ws_server.loop.is_running():
+            time.sleep(0.05)
+        asyncio.run_coroutine_threadsafe(self._serve_ipc(), self.ws_server.loop).result()
+        parent = os.getppid()
+        try:
+            # Exit with the parent even if it died without stopping us
+            while os.getppid() == parent:
+                time.sleep(1)
+        finally:
+            self.registry.clear_worker(self.worker_id)
+            self.sensor_db.close()
+
+
+def run_worker(worker_id: int, config: Dict) -> None:
+    # Turn terminate() into a normal exit so the worker's registry rows and
+    # write queue are cleaned up
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    GatewayWorker(worker_id, config).run()
+
+
+class GatewayClient:
+    """Stands in for WebsocketServer in the Flask process when devices are
+    held by gateway workers."""
+
+    def __init__(self, registry_path: str, socket_dir: str, workers: int,
+                 groups: Optional[Dict] = None, ipc_timeout: float = 5.0):
+        self.registry = DeviceRegistry(registry_path)
+        self.socket_dir = socket_dir
+        self.workers = workers
+        self.device_groups = {name: list(ids) for name, ids in (groups or {}).items()}
+        self.ipc_timeout = ipc_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max(2, workers),
+                                           thread_name_prefix="gateway-ipc")
+
+    def _request(self, worker_id: int, request: Dict, timeout: Optional[float] = None):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout or self.ipc_timeout)
+            sock.connect(socket_path(self.socket_dir, worker_id))
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            with sock.makefile('rb') as f:
+                response = json.loads(f.readline())
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def _request_owner(self, device_id: str, request: Dict, default=None):
+        worker_id = self.registry.owners([device_id]).get(device_id)
+        if worker_id is None:
+            return default
+        try:
+            return self._request(worker_id, request)
+        except Exception as e:
+            print(f"[Gateway] Worker {worker_id} request failed: {e}")
+            return default
+
+    def set_group(self, name, device_ids):
+        self.device_groups[name] = list(device_ids)
+
+    def get_groups(self):
+        return {name: list(ids) for name, ids in self.device_groups.items()}
+
+    def resolve_targets(self, targets):
+        return resolve_targets(self.device_groups, targets)
+
+    def send_command(self, targets, value, timeout=2.0):
+        device_ids = self.resolve_targets(targets)
+        owners = self.registry.owners(device_ids)
+        by_worker = {}
+        for device_id in device_ids:
+            if device_id in owners:
+                by_worker.setdefault(owners[device_id], []).append(device_id)
+
+        # One request per owning worker, all in flight at once
+        futures = {
+            worker_id: self.executor.submit(self._request, worker_id, {
+                'op': 'command',
+                'device_ids': ids,
+                'value': value,
+                'timeout': timeout
+            }, timeout + self.ipc_timeout)
+            for worker_id, ids in by_worker.items()
+        }
+        results = {}
+        for worker_id, future in futures.items():
+            try:
+                results.update(future.result())
+            except Exception as e:
+                for device_id in by_worker[worker_id]:
+                    results[device_id] = {"status": "error", "error": str(e), "latency_ms": None}
+        return {
+            device_id: results.get(device_id, {"status": "not_connected", "latency_ms": None})
+            for device_id in device_ids
+        }
+
+    def send_led_command(self, device_id, value, timeout=2.0):
+        # Single device only; send_command() handles group fan-out
+        if device_id in self.device_groups:
+            raise ValueError(f"{device_id} is a group, use send_command() for groups")
+        return self.send_command(device_id, value, timeout)[device_id]
+
+    def publish(self, topic, payload):
+        # Browsers may be connected to any worker
+        for worker_id in range(self.workers):
+            self.executor.submit(self._request, worker_id, {
+                'op': 'publish', 'topic': topic, 'payload': payload
+            })
+
+    def get_device_list(self):
+        return self.registry.devices()
+
+    def get_sensor_data(self, device_id):
+        return self._request_owner(device_id, {
+            'op': 'sensor_data', 'device_id': device_id
+        }, {})
+
+    def get_recent_readings(self, device_id, sensor_id, seconds):
+        return tuple(self._request_owner(device_id, {
+            'op': 'recent_readings', 'device_id': device_id,
+            'sensor_id': sensor_id, 'seconds': seconds
+        }, ([], [])))
+
+    def get_recent_stats(self, device_id, sensor_id, seconds):
+        return self._request_owner(device_id, {
+            'op': 'recent_stats', 'device_id': device_id,
+            'sensor_id': sensor_id, 'seconds': seconds
+        }, {'count': 0, 'min': None, 'max': None, 'avg': None})
+
+    def get_buffered_history(self, device_id, sensor_id, hours, bucket=3600, tz_offset=0):
+        return self._request_owner(device_id, {
+            'op': 'buffered_history', 'device_id': device_id, 'sensor_id': sensor_id,
+            'hours': hours, 'bucket': bucket, 'tz_offset': tz_offset
+        })
+
+    def get_device_stats(self):
+        # A device that moved between workers has a stale, disconnected entry
+        # on the old one; keep the live entry
+        merged = {}
+        for worker_id in range(self.workers):
+            try:
+                links = self._request(worker_id, {'op': 'device_stats'})
+            except Exception as e:
+                print(f"[Gateway] Worker {worker_id} request failed: {e}")
+                continue
+            for link in links:
+                link['worker_id'] = worker_id
+                current = merged.get(link['device_id'])
+                if current is None or (link['connected'] and not current['connected']):
+                    merged[link['device_id']] = link
+        return [merged[device_id] for device_id in sorted(merged)]
+
+    def get_sink_stats(self):
+        stats = {}
+        for worker_id in range(self.workers):
+            try:
+                stats[worker_id] = self._request(worker_id, {'op': 'stats'})
+            except Exception as e:
+                stats[worker_id] = {'error': str(e)}
+        return stats
+
+
+class Gateway:
+
+    def __init__(self, workers: int = None, host: str = '0.0.0.0', port: int = 5501,
+                 db_path: str = 'sensor_data.db', image_dir: str = 'detection_images',
+                 registry_path: str = 'gateway_registry.db', socket_dir: str = None,
+                 groups: Optional[Dict] = None, compression: Optional[Dict] = None,
+                 log_readings: bool = False):
+        self.workers = workers or os.cpu_count() or 1
+        self.config = {
+            'host': host,
+            'port': port,
+            'db_path': db_path,
+            'image_dir': image_dir,
+            'registry_path': registry_path,
+            'socket_dir': socket_dir or tempfile.mkdtemp(prefix='gateway-'),
+            'groups': groups,
+            'compression': compression,
+            'log_readings': log_readings,
+            'workers': self.workers
+        }
+        self.processes = []
+
+    def start(self) -> GatewayClient:
+        # A fresh interpreter per worker, not fork: the parent may already
+        # hold threads and sqlite connections that must not be copied into
+        # the children. Not multiprocessing's spawn either, which re-imports
+        # the parent's main module in every child.
+        for worker_id in range(self.workers):
+            process = subprocess.Popen([
+                sys.executable, os.path.abspath(__file__),
+                str(worker_id), json.dumps(self.config)
+            ])
+            self.processes.append(process)
+        atexit.register(self.stop)
+        print(f"[Gateway] {self.workers} workers on port {self.config['port']}")
+        return GatewayClient(self.config['registry_path'], self.config['socket_dir'],
+                             self.workers, self.config['groups'])
+
+    def stop(self) -> None:
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+
+
+def main():
+    # Worker entry point used by Gateway.start
+    worker_id, config = int(sys.argv[1]), json.loads(sys.argv[2])
+    run_worker(worker_id, config)
+
+
+if __name__ == '__main__':
+    main()
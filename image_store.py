@@ -0,0 +1,55 @@
+import hashlib
+import os
+import re
+import tempfile
+from typing import Optional
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ImageStore:
+
+    def __init__(self, root: str = 'detection_images', extension: str = '.jpg'):
+        self.root = root
+        self.extension = extension
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path_for(self, key: str) -> str:
+        # Fan out by the first two hex digits to keep directories small
+        return os.path.join(self.root, key[:2], key + self.extension)
+
+    def put(self, data: bytes) -> str:
+        # Content-addressed: identical images share one file and a key never
+        # changes meaning, so it doubles as a strong ETag.
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path_for(key)
+        if os.path.exists(path):
+            return key
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key
+
+    def path(self, key: str) -> Optional[str]:
+        if not KEY_PATTERN.match(key or ''):
+            return None
+        path = self._path_for(key)
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path(key)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
@@ -0,0 +1,132 @@
+"""
+Compact linear model format
+
+A linear SVM only needs its weight vector and bias at inference time, but
+the pickled SVC keeps every support vector and scores through libsvm's
+kernel loop. export_linear() writes just the weights, bias, class labels and
+the feature spec the model was trained on to a .npz file, and LinearModel
+scores with one NumPy dot product per batch. PCA / random projection
+stages in front of the SVM are folded into the weights on export.
+
+Convert an existing pickle:
+    python linear_model.py svm_model.pkl svm_model.npz
+"""
+import argparse
+import json
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class LinearModel:
+    """Binary linear classifier with the predict/decision_function API of
+    the sklearn model it was exported from."""
+
+    def __init__(self, coef: np.ndarray, intercept: float, classes: np.ndarray,
+                 feature_spec: Optional[Dict] = None):
+        self.coef = np.ascontiguousarray(coef, dtype=np.float64).ravel()
+        self.intercept = float(intercept)
+        self.classes = np.asarray(classes)
+        self.feature_spec = feature_spec or {}
+
+    @property
+    def n_features(self) -> int:
+        return self.coef.size
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.coef.size:
+            raise ValueError(f"Expected {self.coef.size} features, got {X.shape[1]}")
+        return X @ self.coef + self.intercept
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        # Same rule as sklearn for binary models: positive score -> classes[1]
+        return self.classes[(self.decision_function(X) > 0).astype(np.intp)]
+
+    def save(self, file) -> None:
+        np.savez(file,
+                 coef=self.coef,
+                 intercept=np.float64(self.intercept),
+                 classes=self.classes,
+                 feature_spec=np.array(json.dumps(self.feature_spec)))
+
+    @classmethod
+    def load(cls, file) -> 'LinearModel':
+        with np.load(file, allow_pickle=False) as data:
+            return cls(data['coef'], data['intercept'], data['classes'],
+                       json.loads(str(data['feature_spec'])))
+
+
+def _affine_map(step):
+    # (A, offset) with step.transform(x) == A @ (x - offset)
+    from sklearn.decomposition import PCA
+    from sklearn.random_projection import BaseRandomProjection
+
+    if isinstance(step, PCA):
+        A = step.components_
+        if step.whiten:
+            A = A / np.sqrt(step.explained_variance_)[:, None]
+        return A, step.mean_
+    if isinstance(step, BaseRandomProjection):
+        return step.components_, None
+    raise ValueError(f"Cannot fold {type(step).__name__} into a linear model")
+
+
+def from_sklearn(model, feature_spec: Optional[Dict] = None) -> LinearModel:
+    # Works for any fitted binary model with coef_/intercept_ (SVC with a
+    # linear kernel, LinearSVC, LogisticRegression, ...), optionally behind
+    # PCA / random projection steps in a Pipeline. Those are linear too, so
+    # they are folded into the weights: w.(A(x - m)) + b ==
+    # (A^T w).x + b - (A^T w).m, and the exported model still scores raw
+    # features with one dot product.
+    steps = [step for _, step in getattr(model, 'steps', [(None, model)])
+             if step is not None and step != 'passthrough']
+    final = steps[-1]
+    try:
+        coef = final.coef_
+    except AttributeError:
+        raise ValueError(f"{type(final).__name__} has no linear weights; "
+                         f"only linear-kernel models can be exported")
+    if len(final.classes_) != 2:
+        raise ValueError(f"Only binary models can be exported, got {len(final.classes_)} classes")
+    coef = coef.toarray() if hasattr(coef, 'toarray') else np.asarray(coef)
+    weights = coef[0].astype(np.float64)
+    intercept = float(final.intercept_[0])
+
+    reduction = []
+    for step in reversed(steps[:-1]):
+        A, offset = _affine_map(step)
+        reduction.insert(0, {'method': type(step).__name__, 'dim': A.shape[0]})
+        weights = np.asarray(A.T @ weights, dtype=np.float64).ravel()
+        if offset is not None:
+            intercept -= float(weights @ offset)
+    if reduction:
+        feature_spec = dict(feature_spec or {}, reduction=reduction)
+    return LinearModel(weights, intercept, final.classes_, feature_spec)
+
+
+def export_linear(model, path: str, feature_spec: Optional[Dict] = None) -> LinearModel:
+    linear = from_sklearn(model, feature_spec)
+    with open(path, 'wb') as f:
+        linear.save(f)
+    return linear
+
+
+def main():
+    import joblib
+    from classifier import FeaturePipeline
+
+    parser = argparse.ArgumentParser(description='Export a pickled linear model to .npz')
+    parser.add_argument('model', help='Pickled sklearn model (e.g. svm_model.pkl)')
+    parser.add_argument('output', help='Output .npz path')
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    linear = export_linear(model, args.output, FeaturePipeline().spec())
+    print(f"Exported {args.model} -> {args.output} ({linear.n_features} features)")
+
+
+if __name__ == '__main__':
+    main()
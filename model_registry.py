@@ -0,0 +1,206 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import joblib
+
+from linear_model import LinearModel
+
+
+class ModelVersion:
+
+    def __init__(self, model, version: str, path: str, mtime: float, size: int, load_ms: float):
+        self.model = model
+        self.version = version
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.load_ms = load_ms
+        self.loaded_at = time.time()
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': self.version,
+            'path': self.path,
+            'mtime': self.mtime,
+            'size': self.size,
+            'load_ms': round(self.load_ms, 3),
+            'loaded_at': self.loaded_at
+        }
+
+
+class ModelRegistry:
+    """Loads a model file once per process and swaps it atomically when the
+    file changes.
+
+    Readers call get() and use the returned ModelVersion for the whole
+    request; a reload only replaces the reference, so a request never sees
+    half a model. Versions are the first 12 hex digits of the file's
+    sha256, so touching the file without changing it does not reload.
+
+    .npz paths hold a LinearModel (see linear_model.py); anything else is a
+    joblib pickle.
+    """
+
+    def __init__(self, path: str = 'svm_model.pkl', history: int = 3):
+        self.path = path
+        self._current = None
+        self._history = deque(maxlen=history)
+        # (mtime, size) and version of the file last looked at, to skip
+        # hashing when nothing changed and to keep a rollback in place while
+        # the file's contents stay the same
+        self._file_state = None
+        self._file_version = None
+        self._lock = threading.Lock()
+        self._watch_thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def _is_linear(self) -> bool:
+        return self.path.endswith('.npz')
+
+    def get(self) -> Optional[ModelVersion]:
+        current = self._current
+        if current is None:
+            self.reload()
+            current = self._current
+        return current
+
+    def _load(self, force: bool) -> Optional[ModelVersion]:
+        stat = os.stat(self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        version = hashlib.sha256(data).hexdigest()[:12]
+        if not force and version == self._file_version:
+            return None
+        if self._current is not None and self._current.version == version:
+            self._file_version = version
+            return None
+        start = time.perf_counter()
+        if self._is_linear:
+            model = LinearModel.load(io.BytesIO(data))
+        else:
+            model = joblib.load(io.BytesIO(data))
+        load_ms = (time.perf_counter() - start) * 1000
+        self._file_version = version
+        return ModelVersion(model, version, self.path, stat.st_mtime, stat.st_size, load_ms)
+
+    def reload(self, force: bool = False) -> bool:
+        # Returns True when a new version became active
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                if self._current is None:
+                    print(f"[Model] Error loading model: {e} model not found")
+                return False
+            file_state = (stat.st_mtime, stat.st_size)
+            if not force and file_state == self._file_state:
+                return False
+            self._file_state = file_state
+
+            try:
+                loaded = self._load(force)
+            except Exception as e:
+                # Keep serving the current model if the new file is bad
+                # (e.g. caught half-written by a non-atomic copy)
+                print(f"[Model] Error loading {self.path}: {e}")
+                self._file_state = None
+                return False
+            if loaded is None:
+                return False
+
+            self._activate(loaded)
+            print(f"[Model] Loaded {self.path} version {loaded.version} "
+                  f"in {loaded.load_ms:.1f} ms")
+            return True
+
+    def _activate(self, target: ModelVersion) -> None:
+        # History keeps each version once, most recent last
+        for old in [v for v in self._history if v.version == target.version]:
+            self._history.remove(old)
+        if self._current is not None:
+            self._history.append(self._current)
+        self._current = target
+
+    def rollback(self, version: Optional[str] = None) -> ModelVersion:
+        # Reactivate the previous version (or a given one from history). The
+        # file on disk is left alone and is not reloaded until it changes.
+        with self._lock:
+            if not self._history:
+                raise ValueError("No previous model version to roll back to")
+            if version is None:
+                target = self._history[-1]
+            else:
+                matches = [v for v in self._history if v.version == version]
+                if not matches:
+                    raise ValueError(f"Unknown model version: {version}")
+                target = matches[-1]
+            self._activate(target)
+            print(f"[Model] Rolled back to version {target.version}")
+            return target
+
+    def publish(self, model) -> ModelVersion:
+        # Write a new model atomically and make it active, e.g. after
+        # retraining; other processes watching the file pick it up too.
+        # A .npz registry takes a LinearModel (see linear_model.from_sklearn)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if self._is_linear:
+                    model.save(f)
+                else:
+                    joblib.dump(model, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.reload(force=True)
+        return self._current
+
+    def start_watching(self, interval: float = 5.0) -> None:
+        if self._watch_thread is not None:
+            return
+
+        def watch_loop():
+            while not self._stop_event.wait(interval):
+                self.reload()
+
+        self._watch_thread = threading.Thread(target=watch_loop, daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self) -> None:
+        self._stop_event.set()
+        if self._watch_thread is not None:
+            self._watch_thread.join()
+            self._watch_thread = None
+
+    def get_status(self) -> Dict:
+        current = self._current
+        history: List[ModelVersion] = list(self._history)
+        return {
+            'path': self.path,
+            'active': current.to_dict() if current else None,
+            'history': [v.to_dict() for v in reversed(history)],
+            'watching': self._watch_thread is not None
+        }
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(path: str = 'svm_model.pkl') -> ModelRegistry:
+    # One registry per model file for the whole process
+    with _registries_lock:
+        registry = _registries.get(path)
+        if registry is None:
+            registry = _registries[path] = ModelRegistry(path)
+        return registry
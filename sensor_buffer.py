@@ -0,0 +1,93 @@
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+
+class SensorRingBuffer:
+
+    def __init__(self, capacity: int = 3600):
+        self.capacity = capacity
+        # Two flat C-double arrays instead of a list of tuples: 16 bytes per
+        # reading and no per-reading Python objects.
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity))
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, value: float) -> None:
+        with self._lock:
+            self._timestamps[self._next] = timestamp
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+
+    def oldest_timestamp(self) -> Optional[float]:
+        with self._lock:
+            if self._count == 0:
+                return None
+            return self._timestamps[(self._next - self._count) % self.capacity]
+
+    def window(self, seconds: float, now: Optional[float] = None) -> Tuple[List[float], List[float]]:
+        # Readings newer than now - seconds, oldest first. Walks backwards from
+        # the newest entry so short windows only touch a few slots.
+        if now is None:
+            now = time.time()
+        since = now - seconds
+        timestamps = []
+        values = []
+        with self._lock:
+            index = self._next
+            for _ in range(self._count):
+                index = (index - 1) % self.capacity
+                if self._timestamps[index] < since:
+                    break
+                timestamps.append(self._timestamps[index])
+                values.append(self._values[index])
+        timestamps.reverse()
+        values.reverse()
+        return timestamps, values
+
+    def stats(self, seconds: float, now: Optional[float] = None) -> Dict:
+        _, values = self.window(seconds, now)
+        if not values:
+            return {'count': 0, 'min': None, 'max': None, 'avg': None}
+        return {
+            'count': len(values),
+            'min': min(values),
+            'max': max(values),
+            'avg': round(sum(values) / len(values), 2)
+        }
+
+    def bucketed(self, since: float, bucket: int, tz_offset: int = 0,
+                 now: Optional[float] = None) -> List[Dict]:
+        # Same shape and bucket alignment as SensorDB.get_history
+        if now is None:
+            now = time.time()
+        timestamps, values = self.window(now - since, now)
+        buckets = {}
+        for timestamp, value in zip(timestamps, values):
+            ts = int(timestamp)
+            start = (ts + tz_offset) // bucket * bucket - tz_offset
+            entry = buckets.get(start)
+            if entry is None:
+                buckets[start] = [value, 1, value, value]
+            else:
+                entry[0] += value
+                entry[1] += 1
+                entry[2] = min(entry[2], value)
+                entry[3] = max(entry[3], value)
+        return [
+            {
+                'timestamp': start,
+                'value': round(entry[0] / entry[1], 2),
+                'min': entry[2],
+                'max': entry[3]
+            }
+            for start, entry in sorted(buckets.items())
+        ]
@@ -0,0 +1,76 @@
+from typing import Dict, List, Tuple
+
+# Rows are (device_id, sensor_id, value, ts), as in SensorDB
+Row = Tuple[str, str, float, int]
+
+
+class DeadbandCompressor:
+    """Per-series deadband filter for raw sensor rows.
+
+    A reading is kept when it differs from the last kept value by more than
+    the sensor's tolerance, or when max_interval seconds have passed since
+    the last kept reading. When a reading breaks out of the band, the last
+    suppressed reading is kept as well, so a chart that draws straight lines
+    between stored points shows a flat segment and then the step, instead of
+    a slope that never happened.
+
+    rules maps sensor_id to {'tolerance': float, 'max_interval': seconds};
+    sensors without a rule pass through untouched.
+    """
+
+    def __init__(self, rules: Dict[str, Dict]):
+        self.rules = rules
+        # (device_id, sensor_id) -> [last kept value, last kept ts,
+        #                            last suppressed row or None]
+        self._state = {}
+        self.stats = {'seen_rows': 0, 'kept_rows': 0}
+
+    def filter(self, rows: List[Row]) -> List[Row]:
+        kept = []
+        for row in rows:
+            device_id, sensor_id, value, ts = row
+            rule = self.rules.get(sensor_id)
+            if rule is None:
+                kept.append(row)
+                continue
+
+            key = (device_id, sensor_id)
+            state = self._state.get(key)
+            if state is None:
+                self._state[key] = [value, ts, None]
+                kept.append(row)
+                continue
+
+            last_value, last_ts, suppressed = state
+            if abs(value - last_value) > rule['tolerance']:
+                if suppressed is not None:
+                    kept.append(suppressed)
+                kept.append(row)
+                state[:] = [value, ts, None]
+            elif ts - last_ts >= rule['max_interval']:
+                kept.append(row)
+                state[:] = [value, ts, None]
+            else:
+                state[2] = row
+
+        self.stats['seen_rows'] += len(rows)
+        self.stats['kept_rows'] += len(kept)
+        return kept
+
+    def drain(self) -> List[Row]:
+        # Suppressed tails, so the raw table ends on each series' real last
+        # value when the writer shuts down
+        rows = [state[2] for state in self._state.values() if state[2] is not None]
+        for state in self._state.values():
+            state[2] = None
+        self.stats['kept_rows'] += len(rows)
+        return rows
+
+    def get_stats(self) -> Dict:
+        seen = self.stats['seen_rows']
+        kept = self.stats['kept_rows']
+        return {
+            'seen_rows': seen,
+            'kept_rows': kept,
+            'ratio': round(seen / kept, 2) if kept else None
+        }
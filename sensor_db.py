@@ -1,183 +1,1040 @@
 import sqlite3
 import datetime
-from typing import List, Dict, Optional
+import threading
+import time
+import atexit
+import argparse
+import base64
+from collections import deque
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, Dict, Optional, Tuple
+from image_store import ImageStore
+from sensor_compression import DeadbandCompressor
+import sensor_export
 
 TIMEZONE_OFFSET = datetime.timedelta(hours=8)
 
+# Sensor rows written before the switch to epoch timestamps stored local time
+# strings at this fixed offset.
+LEGACY_OFFSET_SECONDS = int(TIMEZONE_OFFSET.total_seconds())
+
 def get_local_time():
     return datetime.datetime.utcnow() + TIMEZONE_OFFSET
 
 
 class SensorDB:
     
-    def __init__(self, db_path: str = 'sensor_data.db'):
+    BUSY_TIMEOUT = 5.0
+    CACHED_STATEMENTS = 64
+    # Idle connections kept for reuse; extra ones are closed on check-in
+    POOL_SIZE = 8
+    # Rows from failed flushes are retried on the next flush; past this many
+    # the oldest batches are dropped so a dead disk can't grow memory forever
+    MAX_PENDING_ROWS = 100000
+    CONNECTION_PRAGMAS = (
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA cache_size = -16000',
+        'PRAGMA temp_store = MEMORY',
+        'PRAGMA mmap_size = 67108864'
+    )
+    
+    def __init__(
+        self,
+        db_path: str = 'sensor_data.db',
+        image_dir: str = 'detection_images',
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        raw_retention_hours: int = 48,
+        minute_retention_days: int = 30,
+        compression: Optional[Dict[str, Dict]] = None
+    ):
         self.db_path = db_path
+        self.image_store = ImageStore(image_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.raw_retention = datetime.timedelta(hours=raw_retention_hours)
+        self.minute_retention = datetime.timedelta(days=minute_retention_days)
+        # Deadband filter for raw rows only; rollups still see every reading
+        self.compressor = DeadbandCompressor(compression) if compression else None
+        
+        self._retention_thread = None
+        self._migration_thread = None
+        self._stop_event = threading.Event()
+        
+        self._local = threading.local()
+        self._idle = []
+        self._pool_lock = threading.Lock()
+        
+        self._write_queue = []
+        # (rows, raw_rows) batches that failed to write. raw_rows was already
+        # run through the compressor, so retries must not filter again.
+        self._pending_batches = deque()
+        self._queue_cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._write_stats = {
+            'queued_rows': 0,
+            'flushed_rows': 0,
+            'failed_rows': 0,
+            'write_errors': 0,
+            'flush_count': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+        
         self._init_database()
+        
+        self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.close)
     
-    def _get_connection(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
+    def _open_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.BUSY_TIMEOUT,
+            cached_statements=self.CACHED_STATEMENTS,
+            check_same_thread=False
+        )
         conn.row_factory = sqlite3.Row
+        for pragma in self.CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         return conn
     
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        # Connections are checked out per call and returned to a bounded idle
+        # pool, so short-lived request threads reuse warm connections (and
+        # their prepared statement caches, which make the constant SQL strings
+        # below compile once per connection) without each thread keeping one
+        # open. Nested calls on the same thread share the outer connection.
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        
+        with self._pool_lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._open_connection()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            with self._pool_lock:
+                if len(self._idle) < self.POOL_SIZE:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+    
+    def close_connections(self) -> None:
+        with self._pool_lock:
+            connections, self._idle = self._idle, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                print(f"[SensorDB] Error closing connection: {e}")
+    
     def _init_database(self) -> None:
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sensor_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                device_id TEXT NOT NULL,
-                sensor_id TEXT NOT NULL,
-                value REAL NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_device_sensor_time 
-            ON sensor_data(device_id, sensor_id, timestamp)
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS detection_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                image_data TEXT NOT NULL,
-                result TEXT NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        with self._connection() as conn:
+            cursor = conn.cursor()
+        
+            # WAL lets the HTTP readers run alongside the ingest writer
+            cursor.execute('PRAGMA journal_mode = WAL')
+        
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sensor_data (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    device_id TEXT NOT NULL,
+                    sensor_id TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    ts INTEGER NOT NULL
+                )
+            ''')
+        
+            # Databases created before epoch timestamps only have the local-time
+            # 'timestamp' string column; add 'ts' and convert rows in the background.
+            cursor.execute('PRAGMA table_info(sensor_data)')
+            sensor_columns = {row['name'] for row in cursor.fetchall()}
+            if 'ts' not in sensor_columns:
+                cursor.execute('ALTER TABLE sensor_data ADD COLUMN ts INTEGER')
+        
+            # Covering index: range scans and aggregation never touch the table
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_device_sensor_ts
+                ON sensor_data(device_id, sensor_id, ts, value)
+            ''')
+            
+            # Retention deletes by age across all series
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sensor_ts
+                ON sensor_data(ts)
+            ''')
+        
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_device_sensor_time'"
             )
-        ''')
+            self._ts_migration_pending = cursor.fetchone() is not None
+        
+            # Per device/sensor rollups keyed by bucket start (epoch seconds),
+            # maintained on every batch flush. Raw rows are compacted away by the
+            # retention engine once these cover them.
+            missing_rollups = []
+            for tier in self.ROLLUP_TIERS:
+                cursor.execute(f"PRAGMA table_info({tier['table']})")
+                rollup_columns = {row['name'] for row in cursor.fetchall()}
+                legacy_column = tier['legacy_column']
+                if not rollup_columns:
+                    missing_rollups.append(tier)
+                elif legacy_column in rollup_columns:
+                    cursor.execute(
+                        f"ALTER TABLE {tier['table']} RENAME TO {tier['table']}_legacy"
+                    )
             
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_detection_time 
-            ON detection_records(timestamp)
-        ''')
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {tier['table']} (
+                        device_id TEXT NOT NULL,
+                        sensor_id TEXT NOT NULL,
+                        bucket INTEGER NOT NULL,
+                        count INTEGER NOT NULL,
+                        sum REAL NOT NULL,
+                        min REAL NOT NULL,
+                        max REAL NOT NULL,
+                        PRIMARY KEY (device_id, sensor_id, bucket)
+                    ) WITHOUT ROWID
+                ''')
+            
+                if legacy_column in rollup_columns:
+                    cursor.execute(f'''
+                        INSERT INTO {tier['table']}
+                            (device_id, sensor_id, bucket, count, sum, min, max)
+                        SELECT
+                            device_id,
+                            sensor_id,
+                            CAST(strftime('%s', {legacy_column}) AS INTEGER) - ?,
+                            count, sum, min, max
+                        FROM {tier['table']}_legacy
+                    ''', (LEGACY_OFFSET_SECONDS,))
+                    cursor.execute(f"DROP TABLE {tier['table']}_legacy")
+                    print(f"[SensorDB] Converted {tier['name']} rollup to epoch buckets")
         
-        conn.commit()
-        conn.close()
-        print(f"[SensorDB] Database initialized: {self.db_path}")
-    
-    
-    def insert_sensor_data(self, device_id: str, sensor_id: str, value: float) -> bool:
-        conn = self._get_connection()
-        cursor = conn.cursor()
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_minute_bucket
+                ON sensor_minute(bucket)
+            ''')
+        
+            # image_data is only kept for databases created before the image store;
+            # new rows leave it empty and reference the image by image_key.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS detection_records (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    image_data TEXT NOT NULL DEFAULT '',
+                    image_key TEXT,
+                    image_size INTEGER,
+                    result TEXT NOT NULL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        
+            cursor.execute('PRAGMA table_info(detection_records)')
+            detection_columns = {row['name'] for row in cursor.fetchall()}
+            if 'image_key' not in detection_columns:
+                cursor.execute('ALTER TABLE detection_records ADD COLUMN image_key TEXT')
+                cursor.execute('ALTER TABLE detection_records ADD COLUMN image_size INTEGER')
+            
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_detection_time 
+                ON detection_records(timestamp)
+            ''')
         
-        try:
-            sql = '''
-                INSERT INTO sensor_data (device_id, sensor_id, value, timestamp)
-                VALUES (?, ?, ?, ?)
-            '''
-            timestamp = get_local_time().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute(sql, (device_id, sensor_id, float(value), timestamp))
             conn.commit()
-            return True
-        except Exception as e:
-            conn.rollback()
-            print(f"[SensorDB] Error inserting sensor data: {e}")
-            return False
-        finally:
-            conn.close()
+            print(f"[SensorDB] Database initialized: {self.db_path}")
+        
+            self.migrate_detection_images()
+        
+            # Rollups can only be backfilled once every raw row has an epoch 'ts'
+            if self._ts_migration_pending:
+                # Everything up to here is legacy data; ingest may add rows
+                # (and rollup buckets) before the migration finishes
+                legacy_max_id = cursor.execute('SELECT MAX(id) FROM sensor_data').fetchone()[0]
+                self._migration_thread = threading.Thread(
+                    target=self.migrate_timestamps,
+                    args=(missing_rollups, legacy_max_id),
+                    daemon=True
+                )
+                self._migration_thread.start()
+            else:
+                for tier in missing_rollups:
+                    self._backfill_rollup(tier)
     
-    def get_hourly_average(
-        self, 
-        device_id: str, 
+    def migrate_timestamps(self, backfill_tiers: List[Dict] = (),
+                           backfill_max_id: Optional[int] = None,
+                           chunk_size: int = 5000, pause: float = 0.05) -> int:
+        # Online conversion of legacy local-time strings to epoch seconds,
+        # walking the primary key in short transactions.
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            migrated = 0
+        
+            try:
+                cursor.execute('SELECT MIN(id), MAX(id) FROM sensor_data WHERE ts IS NULL')
+                first_id, last_id = cursor.fetchone()
+                if first_id is not None:
+                    print("[SensorDB] Migrating sensor timestamps to epoch seconds")
+                    for chunk_start in range(first_id, last_id + 1, chunk_size):
+                        if self._stop_event.is_set():
+                            return migrated
+                        cursor.execute('''
+                            UPDATE sensor_data
+                            SET ts = CAST(strftime('%s', timestamp) AS INTEGER) - ?
+                            WHERE id >= ? AND id < ? AND ts IS NULL
+                        ''', (LEGACY_OFFSET_SECONDS, chunk_start, chunk_start + chunk_size))
+                        migrated += cursor.rowcount
+                        conn.commit()
+                        time.sleep(pause)
+            
+                cursor.execute('DROP INDEX IF EXISTS idx_device_sensor_time')
+                conn.commit()
+                self._ts_migration_pending = False
+                print(f"[SensorDB] Timestamp migration finished: {migrated} rows")
+            except Exception as e:
+                conn.rollback()
+                print(f"[SensorDB] Error migrating timestamps: {e}")
+                return migrated
+        
+            if backfill_max_id is not None:
+                for tier in backfill_tiers:
+                    self._backfill_rollup(tier, max_id=backfill_max_id)
+            return migrated
+    
+    def wait_for_migration(self, timeout: Optional[float] = None) -> bool:
+        if self._migration_thread is not None:
+            self._migration_thread.join(timeout)
+        return not self._ts_migration_pending
+    
+    
+    def insert_sensor_data(
+        self,
+        device_id: str,
         sensor_id: str,
-        hours: int = 24
-    ) -> List[Dict]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        value: float,
+        timestamp: Optional[float] = None
+    ) -> bool:
+        if timestamp is None:
+            timestamp = time.time()
+        return self._enqueue_rows([(device_id, sensor_id, float(value), int(timestamp))])
+    
+    def insert_sensor_batch(self, device_id: str, readings: List[Tuple[str, float, float]]) -> bool:
+        # readings are (sensor_id, value, timestamp) for a single device
+        rows = [
+            (device_id, sensor_id, float(value), int(timestamp))
+            for sensor_id, value, timestamp in readings
+        ]
+        return self._enqueue_rows(rows)
+    
+    def _enqueue_rows(self, rows: List[tuple]) -> bool:
+        with self._queue_cond:
+            if not self._closed:
+                self._write_queue.extend(rows)
+                self._write_stats['queued_rows'] += len(rows)
+                if len(self._write_queue) >= self.batch_size:
+                    self._queue_cond.notify()
+                return True
         
-        try:
-            time_threshold = get_local_time() - datetime.timedelta(hours=hours)
-            time_threshold_str = time_threshold.strftime('%Y-%m-%d %H:%M:%S')
+        # Writer already shut down, fall back to a synchronous insert
+        return self._write_sensor_rows(rows)
+    
+    def _write_sensor_rows(self, rows: List[tuple], raw_rows: Optional[List[tuple]] = None) -> bool:
+        # raw_rows is the subset of rows kept in sensor_data (after
+        # compression); the rollups are always built from every row so
+        # averages and counts stay exact.
+        with self._connection() as conn:
+            cursor = conn.cursor()
+        
+            try:
+                sql = '''
+                    INSERT INTO sensor_data (device_id, sensor_id, value, ts)
+                    VALUES (?, ?, ?, ?)
+                '''
+                cursor.executemany(sql, rows if raw_rows is None else raw_rows)
+                for tier in self.ROLLUP_TIERS:
+                    cursor.executemany(
+                        self._rollup_upsert_sql(tier),
+                        self._aggregate_rollup(rows, tier)
+                    )
+                conn.commit()
+                return True
+            except Exception as e:
+                conn.rollback()
+                print(f"[SensorDB] Error inserting sensor data: {e}")
+                return False
+    
+    def _iter_sensor_rows(
+        self,
+        device_id: Optional[str] = None,
+        sensor_id: Optional[str] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        chunk_size: int = 5000
+    ) -> Iterator[List[tuple]]:
+        # Keyset pagination on the primary key: each chunk is a short, separate
+        # read, so memory stays constant and no long read transaction pins
+        # the WAL while a client downloads.
+        conditions = ['id > ?', 'ts IS NOT NULL']
+        params = []
+        for condition, value in (
+            ('device_id = ?', device_id),
+            ('sensor_id = ?', sensor_id),
+            ('ts >= ?', start),
+            ('ts < ?', end)
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        sql = f'''
+            SELECT id, device_id, sensor_id, value, ts
+            FROM sensor_data
+            WHERE {' AND '.join(conditions)}
+            ORDER BY id
+            LIMIT ?
+        '''
+        
+        last_id = 0
+        while True:
+            # The connection goes back to the pool between chunks, while the
+            # consumer handles the previous one
+            with self._connection() as conn:
+                rows = conn.execute(sql, [last_id] + params + [chunk_size]).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [tuple(row)[1:] for row in rows]
+    
+    def export_sensor_data(
+        self,
+        fmt: str = 'ndjson',
+        device_id: Optional[str] = None,
+        sensor_id: Optional[str] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        chunk_size: int = 5000
+    ) -> Iterator[bytes]:
+        chunks = self._iter_sensor_rows(device_id, sensor_id, start, end, chunk_size)
+        return sensor_export.encode_chunks(chunks, fmt)
+    
+    def import_sensor_data(self, stream: BinaryIO, fmt: str = 'ndjson',
+                           batch_size: int = 5000) -> int:
+        # One transaction per batch, rollups included, so a long import never
+        # holds the write lock for more than one batch.
+        imported = 0
+        for rows in sensor_export.decode_chunks(stream, fmt, batch_size):
+            if not self._write_sensor_rows(rows):
+                raise RuntimeError(f"Import failed after {imported} rows")
+            imported += len(rows)
+        print(f"[SensorDB] Imported {imported} sensor rows")
+        return imported
+    
+    # Buckets are epoch seconds aligned to the tier resolution. legacy_column
+    # names the local-time string column used before epoch timestamps.
+    ROLLUP_TIERS = (
+        {
+            'name': 'minute',
+            'table': 'sensor_minute',
+            'seconds': 60,
+            'legacy_column': 'minute'
+        },
+        {
+            'name': 'hour',
+            'table': 'sensor_hourly',
+            'seconds': 3600,
+            'legacy_column': 'hour'
+        }
+    )
+    
+    # Merges new aggregates into an existing bucket
+    ROLLUP_MERGE_SQL = '''
+        ON CONFLICT (device_id, sensor_id, bucket) DO UPDATE SET
+            count = count + excluded.count,
+            sum = sum + excluded.sum,
+            min = MIN(min, excluded.min),
+            max = MAX(max, excluded.max)
+    '''
+    
+    @classmethod
+    def _rollup_upsert_sql(cls, tier: Dict) -> str:
+        return f'''
+            INSERT INTO {tier['table']} (device_id, sensor_id, bucket, count, sum, min, max)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            {cls.ROLLUP_MERGE_SQL}
+        '''
+    
+    @staticmethod
+    def _aggregate_rollup(rows: List[tuple], tier: Dict) -> List[tuple]:
+        seconds = tier['seconds']
+        buckets = {}
+        for device_id, sensor_id, value, ts in rows:
+            key = (device_id, sensor_id, ts - ts % seconds)
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [1, value, value, value]
+            else:
+                bucket[0] += 1
+                bucket[1] += value
+                if value < bucket[2]:
+                    bucket[2] = value
+                if value > bucket[3]:
+                    bucket[3] = value
+        return [key + tuple(bucket) for key, bucket in buckets.items()]
+    
+    def _get_tier(self, name: str) -> Dict:
+        return next(tier for tier in self.ROLLUP_TIERS if tier['name'] == name)
+    
+    def _backfill_rollup(self, tier: Dict, replace: bool = False,
+                         max_id: Optional[int] = None) -> int:
+        # Fill the rollup for every bucket present in sensor_data. Retention
+        # only deletes whole hours of raw data, so these buckets are complete.
+        # Existing buckets are kept unless replace is set: the rollups built
+        # at ingest are exact, while rows dropped by the deadband compressor
+        # are missing from sensor_data, so rebuilding a compressed series
+        # from it would average only the kept points.
+        #
+        # max_id is for the timestamp migration: rows up to it predate ingest
+        # and are in no rollup, so they are added to the buckets ingest has
+        # built since then instead of being skipped.
+        replace = replace and self.compressor is None
+        if max_id is not None:
+            verb, id_filter, conflict = 'INSERT', 'AND id <= ?', self.ROLLUP_MERGE_SQL
+        else:
+            verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+            id_filter, conflict = '', ''
+        with self._flush_lock:
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-            sql = '''
-                SELECT 
-                    strftime('%Y-%m-%d %H:00:00', timestamp) as hour,
-                    AVG(value) as avg_value
-                FROM sensor_data
-                WHERE device_id = ? 
-                    AND sensor_id = ?
-                    AND timestamp >= ?
-                GROUP BY hour
-                ORDER BY hour
-            '''
-            cursor.execute(sql, (device_id, sensor_id, time_threshold_str))
-            results = cursor.fetchall()
+                try:
+                    sql = f'''
+                        {verb} INTO {tier['table']}
+                            (device_id, sensor_id, bucket, count, sum, min, max)
+                        SELECT
+                            device_id,
+                            sensor_id,
+                            ts / ? * ? as bucket_start,
+                            COUNT(*),
+                            SUM(value),
+                            MIN(value),
+                            MAX(value)
+                        FROM sensor_data
+                        WHERE ts IS NOT NULL {id_filter}
+                        GROUP BY device_id, sensor_id, bucket_start
+                        {conflict}
+                    '''
+                    params = [tier['seconds'], tier['seconds']]
+                    if max_id is not None:
+                        params.append(max_id)
+                    cursor.execute(sql, params)
+                    count = cursor.rowcount
+                    conn.commit()
+                    print(f"[SensorDB] Backfilled {count} {tier['name']} rollup rows")
+                    return count
+                except Exception as e:
+                    conn.rollback()
+                    print(f"[SensorDB] Error backfilling {tier['name']} rollup: {e}")
+                    return 0
+    
+    def backfill_hourly(self, replace: bool = False) -> int:
+        return self._backfill_rollup(self._get_tier('hour'), replace)
+    
+    def backfill_minute(self, replace: bool = False) -> int:
+        return self._backfill_rollup(self._get_tier('minute'), replace)
+    
+    def _delete_raw_chunk(self, cutoff: int, chunk_size: int) -> int:
+        # Rows are not appended in time order (imports, device-timestamped
+        # batches), so chunks are picked by ts through idx_sensor_ts rather
+        # than from the front of the id range.
+        with self._connection() as conn:
+            cursor = conn.cursor()
             
+            try:
+                sql = '''
+                    DELETE FROM sensor_data
+                    WHERE id IN (
+                        SELECT id FROM sensor_data
+                        WHERE ts < ?
+                        LIMIT ?
+                    )
+                '''
+                cursor.execute(sql, (cutoff, chunk_size))
+                deleted = cursor.rowcount
+                conn.commit()
+                return deleted
+            except Exception as e:
+                conn.rollback()
+                print(f"[SensorDB] Error compacting raw sensor data: {e}")
+                return 0
+    
+    def _delete_minute_chunk(self, cutoff: int, chunk_size: int) -> int:
+        with self._connection() as conn:
+            cursor = conn.cursor()
+        
+            try:
+                sql = '''
+                    DELETE FROM sensor_minute
+                    WHERE (device_id, sensor_id, bucket) IN (
+                        SELECT device_id, sensor_id, bucket
+                        FROM sensor_minute
+                        WHERE bucket < ?
+                        LIMIT ?
+                    )
+                '''
+                cursor.execute(sql, (cutoff, chunk_size))
+                deleted = cursor.rowcount
+                conn.commit()
+                return deleted
+            except Exception as e:
+                conn.rollback()
+                print(f"[SensorDB] Error compacting minute rollup: {e}")
+                return 0
+    
+    def _retention_cutoffs(self) -> Dict[str, int]:
+        # Cutoffs are aligned to whole hours so a tier never holds a partial
+        # bucket of the tier above it.
+        now = int(time.time())
+        raw_cutoff = now - int(self.raw_retention.total_seconds())
+        minute_cutoff = now - int(self.minute_retention.total_seconds())
+        return {
+            'raw': raw_cutoff - raw_cutoff % 3600,
+            'minute': minute_cutoff - minute_cutoff % 3600
+        }
+    
+    def run_retention(self, chunk_size: int = 5000, pause: float = 0.05) -> Dict[str, int]:
+        # Each chunk is its own short transaction, with a pause in between so
+        # the ingest writer can get the lock.
+        cutoffs = self._retention_cutoffs()
+        deleted = {'raw': 0, 'minute': 0}
+        
+        for name, delete_chunk in (
+            ('raw', self._delete_raw_chunk),
+            ('minute', self._delete_minute_chunk)
+        ):
+            while not self._stop_event.is_set():
+                count = delete_chunk(cutoffs[name], chunk_size)
+                deleted[name] += count
+                if count < chunk_size:
+                    break
+                time.sleep(pause)
+        
+        if deleted['raw'] or deleted['minute']:
+            print(f"[SensorDB] Retention removed {deleted['raw']} raw rows, "
+                  f"{deleted['minute']} minute rows")
+        return deleted
+    
+    def start_retention(self, interval: float = 600.0, chunk_size: int = 5000) -> None:
+        if self._retention_thread is not None:
+            return
+        
+        def retention_loop():
+            while not self._stop_event.is_set():
+                self.run_retention(chunk_size)
+                self._stop_event.wait(interval)
+        
+        self._retention_thread = threading.Thread(target=retention_loop, daemon=True)
+        self._retention_thread.start()
+    
+    def _flush_loop(self) -> None:
+        while True:
+            with self._queue_cond:
+                if not self._closed and len(self._write_queue) < self.batch_size:
+                    self._queue_cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+    
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._queue_cond:
+                rows, self._write_queue = self._write_queue, []
+            if rows:
+                raw_rows = self.compressor.filter(rows) if self.compressor else None
+                with self._queue_cond:
+                    self._pending_batches.append((rows, raw_rows))
+            
+            written = 0
+            while self._pending_batches:
+                rows, raw_rows = self._pending_batches[0]
+                start = time.perf_counter()
+                success = self._write_sensor_rows(rows, raw_rows)
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                
+                with self._queue_cond:
+                    stats = self._write_stats
+                    stats['flush_count'] += 1
+                    stats['last_flush_ms'] = elapsed_ms
+                    stats['max_flush_ms'] = max(stats['max_flush_ms'], elapsed_ms)
+                    stats['total_flush_ms'] += elapsed_ms
+                    if success:
+                        stats['flushed_rows'] += len(rows)
+                        self._pending_batches.popleft()
+                    else:
+                        stats['write_errors'] += 1
+                if not success:
+                    # Keep the batch at the head and retry on the next flush
+                    self._trim_pending()
+                    break
+                written += len(rows)
+            return written
+    
+    def _trim_pending(self) -> None:
+        pending = sum(len(rows) for rows, _ in self._pending_batches)
+        dropped = 0
+        with self._queue_cond:
+            while pending > self.MAX_PENDING_ROWS and len(self._pending_batches) > 1:
+                rows, _ = self._pending_batches.popleft()
+                pending -= len(rows)
+                dropped += len(rows)
+            self._write_stats['failed_rows'] += dropped
+        if dropped:
+            print(f"[SensorDB] Dropped {dropped} unwritten rows, {pending} still pending")
+    
+    def close(self) -> None:
+        with self._queue_cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue_cond.notify_all()
+        self._stop_event.set()
+        if self._retention_thread is not None:
+            self._retention_thread.join()
+        if self._migration_thread is not None:
+            self._migration_thread.join()
+        self._flush_thread.join()
+        # Flush-on-shutdown: drain whatever arrived after the last batch
+        self.flush()
+        if self._pending_batches:
+            pending = sum(len(rows) for rows, _ in self._pending_batches)
+            print(f"[SensorDB] {pending} rows could not be written before close")
+        if self.compressor:
+            tails = self.compressor.drain()
+            if tails:
+                self._write_sensor_rows([], tails)
+        self.close_connections()
+        print(f"[SensorDB] Writer closed: {self.db_path}")
+    
+    def get_write_stats(self) -> Dict:
+        with self._queue_cond:
+            stats = dict(self._write_stats)
+            stats['queue_depth'] = len(self._write_queue)
+            stats['pending_rows'] = sum(len(rows) for rows, _ in self._pending_batches)
+        flush_count = stats['flush_count']
+        stats['avg_flush_ms'] = stats['total_flush_ms'] / flush_count if flush_count else 0.0
+        for key in ('last_flush_ms', 'max_flush_ms', 'avg_flush_ms'):
+            stats[key] = round(stats[key], 3)
+        del stats['total_flush_ms']
+        if self.compressor:
+            stats['compression'] = self.compressor.get_stats()
+        return stats
+    
+    def _select_tier(self, start: int, bucket: int) -> Optional[Dict]:
+        # Pick the finest tier that still holds data back to 'start' and whose
+        # resolution divides the bucket size. None means the raw table.
+        cutoffs = self._retention_cutoffs()
+        if bucket % 3600 == 0:
+            return self._get_tier('hour')
+        if bucket % 60 == 0 and start >= cutoffs['minute']:
+            return self._get_tier('minute')
+        if start >= cutoffs['raw']:
+            return None
+        if start >= cutoffs['minute']:
+            return self._get_tier('minute')
+        return self._get_tier('hour')
+    
+    def _query_buckets(
+        self,
+        series: List[Tuple[str, str]],
+        hours: int,
+        bucket: int,
+        tz_offset: int
+    ) -> List[sqlite3.Row]:
+        # Timestamps in and out are epoch seconds. tz_offset (seconds east of
+        # UTC) only shifts bucket boundaries, e.g. so daily buckets start at
+        # local midnight; formatting is left to the caller.
+        bucket = int(bucket)
+        tz_offset = int(tz_offset)
+        
+        # The current bucket is the last of hours * 3600 / bucket buckets
+        start = int(time.time()) - hours * 3600 + bucket
+        start -= (start + tz_offset) % bucket
+        
+        tier = self._select_tier(start, bucket)
+        if tier is None:
+            table, column = 'sensor_data', 'ts'
+            aggregates = 'SUM(value), COUNT(*), MIN(value), MAX(value)'
+            resolution = 1
+        else:
+            table, column = tier['table'], 'bucket'
+            aggregates = 'SUM(sum), SUM(count), MIN(min), MAX(max)'
+            resolution = tier['seconds']
+        
+        if bucket == resolution and tz_offset % resolution == 0:
+            bucket_expr = column
+        else:
+            bucket_expr = f'({column} + {tz_offset}) / {bucket} * {bucket} - {tz_offset}'
+        
+        # IN lists on both key columns let SQLite seek the index once per
+        # device/sensor combination; combinations nobody asked for are
+        # dropped afterwards.
+        device_ids = sorted({device_id for device_id, _ in series})
+        sensor_ids = sorted({sensor_id for _, sensor_id in series})
+        sql = f'''
+            SELECT device_id, sensor_id, {bucket_expr} as bucket_start, {aggregates}
+            FROM {table}
+            WHERE device_id IN ({', '.join('?' * len(device_ids))})
+                AND sensor_id IN ({', '.join('?' * len(sensor_ids))})
+                AND {column} >= ?
+            GROUP BY device_id, sensor_id, bucket_start
+            ORDER BY bucket_start
+        '''
+        with self._connection() as conn:
+            rows = conn.execute(sql, device_ids + sensor_ids + [start]).fetchall()
+        
+        wanted = set(series)
+        return [row for row in rows if (row[0], row[1]) in wanted]
+    
+    def get_history(
+        self,
+        device_id: str,
+        sensor_id: str,
+        hours: int = 24,
+        bucket: int = 3600,
+        tz_offset: int = 0
+    ) -> List[Dict]:
+        try:
+            rows = self._query_buckets([(device_id, sensor_id)], hours, bucket, tz_offset)
             return [
                 {
-                    'timestamp': row['hour'],
-                    'value': round(row['avg_value'], 2)
+                    'timestamp': row[2],
+                    'value': round(row[3] / row[4], 2),
+                    'min': row[5],
+                    'max': row[6]
                 }
-                for row in results
+                for row in rows
             ]
         except Exception as e:
-            print(f"[SensorDB] Error getting hourly average: {e}")
+            print(f"[SensorDB] Error getting sensor history: {e}")
             return []
-        finally:
-            conn.close()
-    
     
-    def save_detection(self, image_data: str, result: str) -> bool:
-        conn = self._get_connection()
-        cursor = conn.cursor()
+    def get_multi_history(
+        self,
+        series: List[Tuple[str, str]],
+        hours: int = 24,
+        bucket: int = 3600,
+        tz_offset: int = 0
+    ) -> Dict:
+        # Columnar result: one shared timestamp array and one value array per
+        # requested (device_id, sensor_id), None where a series has no data.
+        result = {
+            'timestamps': [],
+            'series': [
+                {'device_id': device_id, 'sensor_id': sensor_id, 'values': []}
+                for device_id, sensor_id in series
+            ]
+        }
+        if not series:
+            return result
         
         try:
-            sql = '''
-                INSERT INTO detection_records (image_data, result, timestamp)
-                VALUES (?, ?, ?)
-            '''
-            timestamp = get_local_time().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute(sql, (image_data, result, timestamp))
-            conn.commit()
-            return True
+            rows = self._query_buckets(series, hours, bucket, tz_offset)
         except Exception as e:
-            conn.rollback()
-            print(f"[SensorDB] Error saving detection: {e}")
-            return False
-        finally:
-            conn.close()
+            print(f"[SensorDB] Error getting multi-series history: {e}")
+            return result
+        
+        timestamps = sorted({row[2] for row in rows})
+        position = {ts: i for i, ts in enumerate(timestamps)}
+        columns = {key: [None] * len(timestamps) for key in series}
+        for row in rows:
+            columns[(row[0], row[1])][position[row[2]]] = round(row[3] / row[4], 2)
+        
+        result['timestamps'] = timestamps
+        for entry, key in zip(result['series'], series):
+            entry['values'] = columns[key]
+        return result
+    
+    def get_hourly_average(
+        self, 
+        device_id: str, 
+        sensor_id: str,
+        hours: int = 24,
+        tz_offset: int = 0
+    ) -> List[Dict]:
+        return self.get_history(device_id, sensor_id, hours, 3600, tz_offset)
+    
+    
+    def save_detection(self, image: bytes, result: str) -> Optional[Dict]:
+        with self._connection() as conn:
+            cursor = conn.cursor()
+        
+            try:
+                image_key = self.image_store.put(image)
+                sql = '''
+                    INSERT INTO detection_records
+                        (image_data, image_key, image_size, result, timestamp)
+                    VALUES ('', ?, ?, ?, ?)
+                '''
+                timestamp = get_local_time().strftime('%Y-%m-%d %H:%M:%S')
+                cursor.execute(sql, (image_key, len(image), result, timestamp))
+                conn.commit()
+                return {
+                    'id': cursor.lastrowid,
+                    'image_key': image_key,
+                    'image_size': len(image),
+                    'result': result,
+                    'timestamp': timestamp
+                }
+            except Exception as e:
+                conn.rollback()
+                print(f"[SensorDB] Error saving detection: {e}")
+                return None
+    
+    def migrate_detection_images(self, chunk_size: int = 20) -> int:
+        # Move legacy base64 images into the image store a few rows at a time
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            migrated = 0
+        
+            try:
+                while True:
+                    cursor.execute('''
+                        SELECT id, image_data
+                        FROM detection_records
+                        WHERE image_key IS NULL AND image_data != ''
+                        LIMIT ?
+                    ''', (chunk_size,))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                
+                    for row in rows:
+                        image = base64.b64decode(row['image_data'])
+                        image_key = self.image_store.put(image)
+                        cursor.execute('''
+                            UPDATE detection_records
+                            SET image_key = ?, image_size = ?, image_data = ''
+                            WHERE id = ?
+                        ''', (image_key, len(image), row['id']))
+                    conn.commit()
+                    migrated += len(rows)
+            except Exception as e:
+                conn.rollback()
+                print(f"[SensorDB] Error migrating detection images: {e}")
+        
+            if migrated:
+                print(f"[SensorDB] Moved {migrated} detection images to {self.image_store.root}")
+            return migrated
     
     def get_latest_detection(self) -> Optional[Dict]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
         
-        try:
-            sql = '''
-                SELECT id, image_data, result, timestamp
-                FROM detection_records
-                ORDER BY timestamp DESC
-                LIMIT 1
-            '''
-            cursor.execute(sql)
-            result = cursor.fetchone()
+            try:
+                sql = '''
+                    SELECT id, image_key, image_size, result, timestamp
+                    FROM detection_records
+                    ORDER BY timestamp DESC
+                    LIMIT 1
+                '''
+                cursor.execute(sql)
+                result = cursor.fetchone()
             
-            if result:
-                return dict(result)
-            return None
-        except Exception as e:
-            print(f"[SensorDB] Error getting latest detection: {e}")
-            return None
-        finally:
-            conn.close()
+                if result:
+                    return dict(result)
+                return None
+            except Exception as e:
+                print(f"[SensorDB] Error getting latest detection: {e}")
+                return None
     
     def get_detection_history(self, limit: int = 10) -> List[Dict]:
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
         
-        try:
-            sql = '''
-                SELECT id, image_data, result, timestamp
-                FROM detection_records
-                ORDER BY timestamp DESC
-                LIMIT ?
-            '''
-            cursor.execute(sql, (limit,))
-            results = cursor.fetchall()
+            try:
+                sql = '''
+                    SELECT id, image_key, image_size, result, timestamp
+                    FROM detection_records
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                '''
+                cursor.execute(sql, (limit,))
+                results = cursor.fetchall()
             
-            return [dict(row) for row in results]
-        except Exception as e:
-            print(f"[SensorDB] Error getting detection history: {e}")
-            return []
-        finally:
-            conn.close()
+                return [dict(row) for row in results]
+            except Exception as e:
+                print(f"[SensorDB] Error getting detection history: {e}")
+                return []
+    
+    def get_detection_image_path(self, image_key: str) -> Optional[str]:
+        return self.image_store.path(image_key)
+
+def main():
+    parser = argparse.ArgumentParser(description='SensorDB maintenance')
+    parser.add_argument(
+        'command',
+        choices=[
+            'backfill-hourly',
+            'backfill-minute',
+            'retention',
+            'migrate-images',
+            'migrate-timestamps',
+            'export',
+            'import'
+        ]
+    )
+    parser.add_argument('--db', default='sensor_data.db', help='Database path')
+    parser.add_argument('--format', default='ndjson', choices=sensor_export.FORMATS,
+                        help='Export/import format')
+    parser.add_argument('--file', help='Export output or import input file')
+    parser.add_argument('--device-id', help='Only export this device')
+    parser.add_argument('--sensor-id', help='Only export this sensor')
+    parser.add_argument('--start', type=int, help='Export from this epoch second')
+    parser.add_argument('--end', type=int, help='Export up to this epoch second')
+    parser.add_argument('--replace', action='store_true',
+                        help='Backfill: overwrite existing rollup buckets from raw rows '
+                             '(only exact if raw rows were stored without compression)')
+    args = parser.parse_args()
+    
+    if args.command in ('export', 'import') and not args.file:
+        parser.error(f"{args.command} requires --file")
+    
+    db = SensorDB(args.db)
+    try:
+        if args.command == 'backfill-hourly':
+            db.backfill_hourly(args.replace)
+        elif args.command == 'backfill-minute':
+            db.backfill_minute(args.replace)
+        elif args.command == 'retention':
+            db.run_retention()
+        elif args.command == 'migrate-images':
+            db.migrate_detection_images()
+        elif args.command == 'migrate-timestamps':
+            # Started by the constructor when needed; wait for it to finish
+            db.wait_for_migration()
+        elif args.command == 'export':
+            db.wait_for_migration()
+            with open(args.file, 'wb') as f:
+                for chunk in db.export_sensor_data(
+                    args.format, args.device_id, args.sensor_id, args.start, args.end
+                ):
+                    f.write(chunk)
+            print(f"[SensorDB] Exported sensor data to {args.file}")
+        elif args.command == 'import':
+            with open(args.file, 'rb') as f:
+                db.import_sensor_data(f, args.format)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
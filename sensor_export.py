@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+import struct
+import sys
+from array import array
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+
+# Rows are (device_id, sensor_id, value, ts) throughout, matching the tuples
+# SensorDB writes.
+Row = Tuple[str, str, float, int]
+
+FORMATS = ('ndjson', 'csv', 'columnar')
+
+MIME_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'columnar': 'application/octet-stream'
+}
+
+CSV_HEADER = ['device_id', 'sensor_id', 'ts', 'value']
+
+# Columnar layout: MAGIC, then blocks of
+#   <II>  row count, key count        (a zero row count ends the stream)
+#   keys  <H> length + utf-8 device_id, <H> length + utf-8 sensor_id
+#   <H>   key index per row
+#   <q>   ts per row
+#   <d>   value per row
+# All integers and floats are little-endian.
+MAGIC = b'SDBC\x01'
+BLOCK_HEADER = struct.Struct('<II')
+STRING_LENGTH = struct.Struct('<H')
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_ndjson(rows: List[Row]) -> bytes:
+    return ''.join(
+        json.dumps({'device_id': d, 'sensor_id': s, 'ts': ts, 'value': v}) + '\n'
+        for d, s, v, ts in rows
+    ).encode('utf-8')
+
+
+def encode_csv(rows: List[Row], header: bool = False) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(CSV_HEADER)
+    writer.writerows((d, s, ts, v) for d, s, v, ts in rows)
+    return out.getvalue().encode('utf-8')
+
+
+def encode_columnar(rows: List[Row]) -> bytes:
+    keys = {}
+    indexes = array('H')
+    timestamps = array('q')
+    values = array('d')
+    for device_id, sensor_id, value, ts in rows:
+        key = (device_id, sensor_id)
+        index = keys.get(key)
+        if index is None:
+            index = keys[key] = len(keys)
+        indexes.append(index)
+        timestamps.append(ts)
+        values.append(value)
+
+    parts = [BLOCK_HEADER.pack(len(rows), len(keys))]
+    for device_id, sensor_id in keys:
+        for text in (device_id, sensor_id):
+            encoded = text.encode('utf-8')
+            parts.append(STRING_LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+    parts.append(_little_endian(indexes))
+    parts.append(_little_endian(timestamps))
+    parts.append(_little_endian(values))
+    return b''.join(parts)
+
+
+def encode_chunks(chunks: Iterable[List[Row]], fmt: str) -> Iterator[bytes]:
+    # One output chunk per input chunk, so memory stays at one chunk
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    if fmt == 'columnar':
+        yield MAGIC
+    first = True
+    for rows in chunks:
+        if fmt == 'ndjson':
+            yield encode_ndjson(rows)
+        elif fmt == 'csv':
+            yield encode_csv(rows, header=first)
+        else:
+            yield encode_columnar(rows)
+        first = False
+    if fmt == 'csv' and first:
+        yield encode_csv([], header=True)
+    if fmt == 'columnar':
+        yield BLOCK_HEADER.pack(0, 0)
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        part = stream.read(size - len(data))
+        if not part:
+            raise ValueError('Unexpected end of columnar stream')
+        data += part
+    return data
+
+
+def _read_array(stream: BinaryIO, typecode: str, count: int) -> array:
+    values = array(typecode)
+    values.frombytes(_read_exact(stream, values.itemsize * count))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _decode_columnar(stream: BinaryIO) -> Iterator[List[Row]]:
+    if _read_exact(stream, len(MAGIC)) != MAGIC:
+        raise ValueError('Not a columnar sensor export')
+    while True:
+        row_count, key_count = BLOCK_HEADER.unpack(_read_exact(stream, BLOCK_HEADER.size))
+        if row_count == 0:
+            return
+        keys = []
+        for _ in range(key_count):
+            pair = []
+            for _ in range(2):
+                (length,) = STRING_LENGTH.unpack(_read_exact(stream, STRING_LENGTH.size))
+                pair.append(_read_exact(stream, length).decode('utf-8'))
+            keys.append(tuple(pair))
+        indexes = _read_array(stream, 'H', row_count)
+        timestamps = _read_array(stream, 'q', row_count)
+        values = _read_array(stream, 'd', row_count)
+        yield [
+            keys[index] + (value, ts)
+            for index, ts, value in zip(indexes, timestamps, values)
+        ]
+
+
+def _decode_text(stream: BinaryIO, fmt: str, batch_size: int) -> Iterator[List[Row]]:
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        records = csv.DictReader(text)
+    else:
+        records = (json.loads(line) for line in text if line.strip())
+
+    batch = []
+    for record in records:
+        batch.append((
+            record['device_id'],
+            record['sensor_id'],
+            float(record['value']),
+            int(record['ts'])
+        ))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def decode_chunks(stream: BinaryIO, fmt: str, batch_size: int = 5000) -> Iterator[List[Row]]:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown import format: {fmt}")
+    if fmt == 'columnar':
+        return _decode_columnar(stream)
+    return _decode_text(stream, fmt, batch_size)
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from threading import Timer
 import datetime
@@ -6,18 +6,63 @@ import cv2
 import base64
 import time
 from classifier import Classifier
+from camera_service import CameraService
 from websocket_server import WebsocketServer
-from sensor_db import SensorDB
+from gateway import Gateway
+from sensor_db import SensorDB, TIMEZONE_OFFSET
+import sensor_export
+import io
+import os
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-sensor_db = SensorDB('sensor_data.db')
+# Deadband compression of raw rows per sensor: a reading is stored when it
+# moves more than 'tolerance' or 'max_interval' seconds have passed.
+# Rollups (and so hourly averages) still include every reading.
+SENSOR_COMPRESSION = {
+    'temperature': {'tolerance': 0.1, 'max_interval': 300},
+    'humidity': {'tolerance': 0.5, 'max_interval': 300}
+}
+
+sensor_db = SensorDB('sensor_data.db', compression=SENSOR_COMPRESSION)
+
+# Owns the camera for the whole process; started in __main__
+camera = CameraService()
+
+# Shared by every request; the model is loaded once and hot-reloaded when
+# the file changes. detection.py publishes retrained models to
+# svm_model.pkl, so that stays the default. MODEL_PATH=svm_model.npz opts in
+# to the exported linear model (see linear_model.py), which scores with one
+# dot product; re-export after retraining in that case.
+MODEL_PATH = os.environ.get('MODEL_PATH', 'svm_model.pkl')
+classifier = Classifier(MODEL_PATH)
+
+TZ_OFFSET_SECONDS = int(TIMEZONE_OFFSET.total_seconds())
 
 wake_up_time_str = None  
 timer = None
 ws_server = None
 
+# Worker processes accepting device connections; 0 runs the WebSocket server
+# in a thread of this process instead
+GATEWAY_WORKERS = int(os.environ.get('GATEWAY_WORKERS', '0'))
+gateway = None
+
+# 'unified' serves HTTP and device WebSockets from one asyncio loop
+# (needs aiohttp, see async_server.py); 'threaded' runs the Flask dev server
+# with the WebSocket server in a background thread
+SERVER_MODE = os.environ.get('SERVER_MODE', 'threaded')
+
+# LOG_READINGS=1 prints every reading as it arrives; off by default since
+# the prints run synchronously on the ingest path
+LOG_READINGS = os.environ.get('LOG_READINGS', '0') == '1'
+
+# Named device groups for command fan-out
+DEVICE_GROUPS = {
+    'bedroom': ['alarm-clock']
+}
+
 @app.route('/api/timer-time', methods=['GET'])
 def get_timer_time():
     global wake_up_time_str
@@ -35,24 +80,33 @@ def set_time():
 
 @app.route('/api/take-image', methods=['GET'])
 def capture_image():
-    cap = cv2.VideoCapture(0)
-    classifier = Classifier()
-    if not cap.isOpened():
-        return jsonify({'status': 'error', 'message': 'Failed to open camera'})
-    ret, frame = cap.read()
-    success, buffer = cv2.imencode('.jpg', frame)
-    if not success:
-        return jsonify({'status': 'error', 'message': 'Failed to encode image'})
+    try:
+        with camera.frame(newer_than=time.time() - 1.0) as (frame, _):
+            success, buffer = cv2.imencode('.jpg', frame)
+            if not success:
+                return jsonify({'status': 'error', 'message': 'Failed to encode image'})
+            result = classifier.classify(frame)
+    except TimeoutError:
+        return jsonify({'status': 'error', 'message': 'Failed to read from camera'})
     image = base64.b64encode(buffer).decode('utf-8')
-    result = classifier.classify(frame)
     print(f"Result: {result}")
-    cap.release()
     return jsonify({'status': 'success', 'message': 'Image captured successfully', 'image': image, 'result': result})
 
 @app.route('/api/devices', methods=['GET'])
 def get_device_list():
     global ws_server
     if ws_server:
+        if request.args.get('detail', 'false').lower() == 'true':
+            # Per-device link health: heartbeat RTT, traffic, reconnects and
+            # command latency. Disconnected devices are included unless
+            # connected=true.
+            devices = ws_server.get_device_stats()
+            if request.args.get('connected', 'false').lower() == 'true':
+                devices = [device for device in devices if device['connected']]
+            return jsonify({
+                'status': 'success',
+                'devices': devices
+            })
         device_list = ws_server.get_device_list()
         print(f"Device list: {device_list}")
         return jsonify({
@@ -70,11 +124,23 @@ def send_led_command(device_id, value='toggle'):
     global ws_server
     if ws_server:
         try:
-            ws_server.send_led_command(device_id, value)
+            result = ws_server.send_led_command(device_id, value)
+            if result['status'] != 'acked':
+                return jsonify({
+                    'status': 'error',
+                    'message': f'Command to {device_id} not acknowledged: {result["status"]}',
+                    'result': result
+                }), 504
             return jsonify({
                 'status': 'success',
-                'message': f'Message sent to {device_id}: {value}'
+                'message': f'Message sent to {device_id}: {value}',
+                'result': result
             })
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': f'{device_id} is a device group; use POST /api/command for groups'
+            }), 400
         except Exception as e:
             return jsonify({
                 'status': 'error',
@@ -86,6 +152,49 @@ def send_led_command(device_id, value='toggle'):
             'message': 'WebSocket server not running'
         }), 500
 
+@app.route('/api/command', methods=['POST'])
+def send_command():
+    # {"targets": "<device or group>" | [...], "value": "on", "timeout": 2.0}
+    if not ws_server:
+        return jsonify({
+            'status': 'error',
+            'message': 'WebSocket server not running'
+        }), 500
+    
+    data = request.get_json() or {}
+    targets = data.get('targets')
+    value = data.get('value')
+    if not targets or not value:
+        return jsonify({
+            'status': 'error',
+            'message': 'Both targets and value are required'
+        }), 400
+    
+    try:
+        results = ws_server.send_command(targets, value, float(data.get('timeout', 2.0)))
+        return jsonify({
+            'status': 'success',
+            'delivered': sum(1 for r in results.values() if r['status'] == 'acked'),
+            'results': results
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Error sending command: {e}'
+        }), 500
+
+@app.route('/api/groups', methods=['GET'])
+def get_device_groups():
+    if not ws_server:
+        return jsonify({
+            'status': 'error',
+            'message': 'WebSocket server not running'
+        }), 500
+    return jsonify({
+        'status': 'success',
+        'groups': ws_server.get_groups()
+    })
+
 @app.route('/api/sensor-data/<device_id>', methods=['GET'])
 def get_sensor_data( device_id ):
     global ws_server
@@ -107,16 +216,28 @@ def get_sensor_data( device_id ):
     }), 500
 
 
+def format_timestamp(ts):
+    # The database stores epoch seconds; the API speaks local time
+    local_time = datetime.datetime.utcfromtimestamp(ts) + TIMEZONE_OFFSET
+    return local_time.strftime('%Y-%m-%d %H:%M:%S')
+
 @app.route('/api/sensor-history/<device_id>', methods=['GET'])
 def get_sensor_history_hourly(device_id):
     sensor_id = request.args.get('sensor_id')
     hours = request.args.get('hours', 24, type=int)
+    bucket = request.args.get('bucket', 3600, type=int)
     
     try:
-        data = sensor_db.get_hourly_average(device_id, sensor_id, hours)
+        data = None
+        if ws_server:
+            data = ws_server.get_buffered_history(
+                device_id, sensor_id, hours, bucket, TZ_OFFSET_SECONDS
+            )
+        if data is None:
+            data = sensor_db.get_history(device_id, sensor_id, hours, bucket, TZ_OFFSET_SECONDS)
         
         simplified_data = [
-            {'timestamp': item['timestamp'], 'value': item['value']}
+            {'timestamp': format_timestamp(item['timestamp']), 'value': item['value']}
             for item in data
         ]
         
@@ -133,6 +254,113 @@ def get_sensor_history_hourly(device_id):
             'message': f'Database error: {str(e)}'
         }), 500
 
+@app.route('/api/sensor-recent/<device_id>', methods=['GET'])
+def get_sensor_recent(device_id):
+    sensor_id = request.args.get('sensor_id')
+    minutes = request.args.get('minutes', 5, type=float)
+    if ws_server is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'WebSocket server not running'
+        }), 500
+    
+    seconds = minutes * 60
+    timestamps, values = ws_server.get_recent_readings(device_id, sensor_id, seconds)
+    return jsonify({
+        'status': 'success',
+        'device_id': device_id,
+        'sensor_id': sensor_id,
+        'timestamps': timestamps,
+        'values': values,
+        'stats': ws_server.get_recent_stats(device_id, sensor_id, seconds)
+    })
+
+@app.route('/api/sensor-history-batch', methods=['GET'])
+def get_sensor_history_batch():
+    # ?series=<device_id>:<sensor_id>,...  (the parameter may also repeat)
+    series = []
+    for value in request.args.getlist('series'):
+        for item in value.split(','):
+            device_id, _, sensor_id = item.rpartition(':')
+            if device_id and sensor_id:
+                series.append((device_id, sensor_id))
+    if not series:
+        return jsonify({
+            'status': 'error',
+            'message': 'No series requested, expected series=<device_id>:<sensor_id>'
+        }), 400
+    
+    hours = request.args.get('hours', 24, type=int)
+    bucket = request.args.get('bucket', 3600, type=int)
+    
+    try:
+        data = sensor_db.get_multi_history(series, hours, bucket, TZ_OFFSET_SECONDS)
+        return jsonify({
+            'status': 'success',
+            'bucket': bucket,
+            'timestamps': [format_timestamp(ts) for ts in data['timestamps']],
+            'series': data['series']
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Database error: {str(e)}'
+        }), 500
+
+@app.route('/api/sensor-export', methods=['GET'])
+def export_sensor_data():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in sensor_export.FORMATS:
+        return jsonify({
+            'status': 'error',
+            'message': f'Unknown format {fmt}, expected one of {sensor_export.FORMATS}'
+        }), 400
+    
+    chunks = sensor_db.export_sensor_data(
+        fmt,
+        request.args.get('device_id'),
+        request.args.get('sensor_id'),
+        request.args.get('start', type=int),
+        request.args.get('end', type=int)
+    )
+    extension = 'sdbc' if fmt == 'columnar' else fmt
+    return Response(
+        stream_with_context(chunks),
+        mimetype=sensor_export.MIME_TYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename=sensor_data.{extension}'}
+    )
+
+@app.route('/api/sensor-import', methods=['POST'])
+def import_sensor_data():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in sensor_export.FORMATS:
+        return jsonify({
+            'status': 'error',
+            'message': f'Unknown format {fmt}, expected one of {sensor_export.FORMATS}'
+        }), 400
+    
+    try:
+        count = sensor_db.import_sensor_data(io.BufferedReader(request.stream), fmt)
+        return jsonify({
+            'status': 'success',
+            'count': count
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Import error: {str(e)}'
+        }), 500
+
+def detection_to_json(record):
+    return {
+        'id': record['id'],
+        'result': record['result'],
+        'timestamp': record['timestamp'],
+        'image_size': record['image_size'],
+        'image_url': f"/api/detection-image/{record['image_key']}"
+            if record['image_key'] else None
+    }
+
 @app.route('/api/last-detection', methods=['GET'])
 def get_last_detection():
     try:
@@ -140,7 +368,7 @@ def get_last_detection():
         if record:
             return jsonify({
                 'status': 'success',
-                'image': record['image_data'],
+                'image_url': detection_to_json(record)['image_url'],
                 'detection_result': record['result'],
                 'detection_time': record['timestamp']
             })
@@ -164,7 +392,7 @@ def get_detection_history():
         return jsonify({
             'status': 'success',
             'count': len(records),
-            'data': records
+            'data': [detection_to_json(record) for record in records]
         })
     except Exception as e:
         return jsonify({
@@ -172,13 +400,81 @@ def get_detection_history():
             'message': f'Database error: {str(e)}'
         }), 500
 
+@app.route('/api/detection-image/<image_key>', methods=['GET'])
+def get_detection_image(image_key):
+    path = sensor_db.get_detection_image_path(image_key)
+    if path is None:
+        return jsonify({
+            'status': 'error',
+            'message': f'Image {image_key} not found'
+        }), 404
+    # Keys are content hashes, so the bytes behind a URL never change
+    response = send_file(
+        path,
+        mimetype='image/jpeg',
+        conditional=True,
+        etag=image_key,
+        max_age=31536000
+    )
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/model', methods=['GET'])
+def get_model_status():
+    return jsonify({
+        'status': 'success',
+        'model': classifier.registry.get_status()
+    })
+
+@app.route('/api/model/reload', methods=['POST'])
+def reload_model():
+    reloaded = classifier.registry.reload(force=True)
+    return jsonify({
+        'status': 'success',
+        'reloaded': reloaded,
+        'model': classifier.registry.get_status()
+    })
+
+@app.route('/api/model/rollback', methods=['POST'])
+def rollback_model():
+    data = request.get_json(silent=True) or {}
+    try:
+        classifier.registry.rollback(data.get('version'))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    return jsonify({
+        'status': 'success',
+        'model': classifier.registry.get_status()
+    })
+
+@app.route('/api/camera-stats', methods=['GET'])
+def get_camera_stats():
+    return jsonify({
+        'status': 'success',
+        'camera': camera.get_stats()
+    })
+
+@app.route('/api/db-stats', methods=['GET'])
+def get_db_stats():
+    return jsonify({
+        'status': 'success',
+        'write_stats': sensor_db.get_write_stats(),
+        'sink_stats': ws_server.get_sink_stats() if ws_server else None
+    })
+
 def save_sensor_data_to_db(device_id, sensor_id, value):
     success = sensor_db.insert_sensor_data(device_id, sensor_id, value)
-    if success:
-        print(f"[Server] Saved: {device_id} - {sensor_id}: {value}")
-    else:
+    if not success:
         print(f"[Server] Failed: {device_id} - {sensor_id}: {value}")
 
+def save_sensor_batch_to_db(device_id, readings):
+    success = sensor_db.insert_sensor_batch(device_id, readings)
+    if not success:
+        print(f"[Server] Failed: {device_id} - {len(readings)} readings")
+
 def set_wake_time(time_str):
     global wake_up_time_str, timer
     wake_up_time_str = time_str
@@ -199,33 +495,28 @@ def set_wake_time(time_str):
 
 
 def check_bed_presence():
-    ws_server.send_led_command('alarm-clock', 'on')
-    time.sleep(1)
+    results = ws_server.send_command('bedroom', 'on')
+    print(f"[Server] Alarm lights: {results}")
     
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("[Server] Failed to open camera")
-        return False
-    
-    ret, frame = cap.read()
-    cap.release()
-    
-    if not ret:
+    # Let the room light settle, then use the first frame taken after that
+    time.sleep(1)
+    try:
+        with camera.frame(newer_than=time.time()) as (frame, _):
+            result = classifier.classify(frame)
+            _, buffer = cv2.imencode(".jpg", frame)
+    except TimeoutError:
         print("[Server] Failed to read image")
         return False
-
-    result = Classifier().classify(frame)
-    
-    _, buffer = cv2.imencode(".jpg", frame)
-    image_base64 = base64.b64encode(buffer).decode("utf-8")
     
-    sensor_db.save_detection(image_base64, result)
+    record = sensor_db.save_detection(buffer.tobytes(), result)
     print(f"[Server] Detection saved: {result}")
+    if record:
+        ws_server.publish('detection', detection_to_json(record))
     
     if result == 'on-bed':
         return True
     else:
-        ws_server.send_led_command('alarm-clock', 'off')
+        ws_server.send_command('bedroom', 'off')
         return False
 
 if __name__ == '__main__':
@@ -233,13 +524,48 @@ if __name__ == '__main__':
     print("Smart Light Alarm Server")
     print("=" * 50)
     
-    ws_server = WebsocketServer(on_sensor_data=save_sensor_data_to_db)
-    ws_server.start_in_thread()
+    if GATEWAY_WORKERS:
+        # Workers own the device sockets and write readings themselves;
+        # ws_server becomes a client that routes to them
+        gateway = Gateway(GATEWAY_WORKERS, groups=DEVICE_GROUPS,
+                          compression=SENSOR_COMPRESSION, log_readings=LOG_READINGS)
+        ws_server = gateway.start()
+    elif SERVER_MODE == 'unified':
+        # Started by run() below, which takes over the main thread
+        from async_server import UnifiedServer
+        ws_server = UnifiedServer(
+            app,
+            http_port=5502,
+            on_sensor_data=save_sensor_data_to_db,
+            on_sensor_batch=save_sensor_batch_to_db,
+            groups=DEVICE_GROUPS,
+            log_readings=LOG_READINGS
+        )
+    else:
+        ws_server = WebsocketServer(
+            on_sensor_data=save_sensor_data_to_db,
+            on_sensor_batch=save_sensor_batch_to_db,
+            groups=DEVICE_GROUPS,
+            log_readings=LOG_READINGS
+        )
+        ws_server.start_in_thread()
+    sensor_db.start_retention()
+    camera.start()
+    classifier.registry.start_watching()
     
     print("\nServer is running:")
     print("  HTTP API: http://0.0.0.0:5502")
     print("  WebSocket: ws://0.0.0.0:5501")
     print("=" * 50 + "\n")
     
-    app.run(host='0.0.0.0', port=5502, debug=True, use_reloader=False)
+    try:
+        if not GATEWAY_WORKERS and SERVER_MODE == 'unified':
+            ws_server.run()
+        else:
+            app.run(host='0.0.0.0', port=5502, debug=True, use_reloader=False)
+    finally:
+        if gateway:
+            gateway.stop()
+        camera.stop()
+        sensor_db.close()
     
\ No newline at end of file
@@ -2,16 +2,23 @@ import cv2
 import numpy as np
 import os
 from sklearn.model_selection import train_test_split
-from sklearn.svm import SVC
 from sklearn.metrics import accuracy_score, classification_report
 import matplotlib.pyplot as plt
 import joblib
 import random
 from PIL import Image, ImageOps
+from classifier import FeaturePipeline
+from linear_model import export_linear
+from feature_reduction import make_model
 
 on_bed_dataset = "./3127_dataset/on-bed"
 off_bed_dataset = "./3127_dataset/off-bed"
 
+# optional reduction of the HOG features before the SVM: None, 'pca' or
+# 'random'. bench_reduction.py compares accuracy and latency per size
+REDUCTION = None
+REDUCED_DIM = 256
+
 on_bed_images = [cv2.imread(os.path.join(on_bed_dataset, img)) for img in os.listdir(on_bed_dataset) if img.endswith(('.jpg', '.png'))]
 off_bed_images = [cv2.imread(os.path.join(off_bed_dataset, img)) for img in os.listdir(off_bed_dataset) if img.endswith(('.jpg', '.png'))]
 
@@ -57,29 +64,11 @@ extend_off_bed_3 = augment_images(off_bed_images)
 on_bed_images += extend_on_bed_1 + extend_on_bed_2 + extend_on_bed_3
 off_bed_images += extend_off_bed_1 + extend_off_bed_2 + extend_off_bed_3
 
-# turn in to grayscale
-on_bed_images = [
-    cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
-    for img in on_bed_images
-]
-off_bed_images = [
-    cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
-    for img in off_bed_images
-]
-
-# resize to 128x128
-on_bed_images = [cv2.resize(img, (128, 128)) for img in on_bed_images]
-off_bed_images = [cv2.resize(img, (128, 128)) for img in off_bed_images]
-
-# canny edge detection
-on_bed_images = [cv2.Canny(img, 100, 200) for img in on_bed_images]
-off_bed_images = [cv2.Canny(img, 100, 200) for img in off_bed_images]
-
-# hog descriptor
-hog = cv2.HOGDescriptor()
-hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
-on_bed_features = [hog.compute(img).flatten() for img in on_bed_images]
-off_bed_features = [hog.compute(img).flatten() for img in off_bed_images]
+# grayscale -> 128x128 -> canny -> hog, the same pipeline the classifier
+# runs at inference time
+pipeline = FeaturePipeline()
+on_bed_features = pipeline.extract_batch(on_bed_images)
+off_bed_features = pipeline.extract_batch(off_bed_images)
 
 # combine all data
 X = np.vstack([on_bed_features, off_bed_features])
@@ -90,7 +79,7 @@ X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.15, random
 
 # train SVM classifier
 print("訓練 SVM 分類器中...")
-svm = SVC(kernel='linear')
+svm = make_model(REDUCTION, REDUCED_DIM)
 svm.fit(X_train, y_train)
 
 # test classifier
@@ -104,4 +93,8 @@ print("\n分類報告:")
 print(classification_report(y_test, y_pred, target_names=['off-bed', 'on-bed']))
 
 # save model
-joblib.dump(svm, 'svm_model.pkl')
\ No newline at end of file
+joblib.dump(svm, 'svm_model.pkl')
+
+# export weights + bias only; the server scores this with one dot product
+export_linear(svm, 'svm_model.npz', pipeline.spec())
+print("線性模型已匯出至 svm_model.npz")
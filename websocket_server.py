@@ -3,59 +3,423 @@ import asyncio
 import json
 import time
 import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from sensor_buffer import SensorRingBuffer
+from device_link import DeviceLink, TokenBucket
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def resolve_targets(groups, targets):
+    # A target is a device id or a group name; lists may mix both
+    if isinstance(targets, str):
+        targets = [targets]
+    device_ids = []
+    for target in targets:
+        for device_id in groups.get(target, [target]):
+            if device_id not in device_ids:
+                device_ids.append(device_id)
+    return device_ids
 
 class WebsocketServer:
-    def __init__(self, host='0.0.0.0', port=5501, on_sensor_data=None):
+    TOPICS = ("sensor", "device", "detection")
+    OVERFLOW_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(self, host='0.0.0.0', port=5501, on_sensor_data=None, buffer_size=3600,
+                 on_sensor_batch=None, sink_workers=2, sink_queue_size=1000,
+                 overflow_policy="block", groups=None, reuse_port=False,
+                 on_register=None, on_unregister=None, heartbeat_interval=10.0,
+                 heartbeat_timeout=5.0, max_missed_pongs=2, rate_limit=50.0,
+                 rate_burst=200.0, max_message_size=65536, max_pending_per_connection=50,
+                 disconnect_after=None, log_readings=False, on_publish=None):
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
         self.host = host
         self.port = port
+        # With reuse_port several processes can listen on the same port and
+        # the kernel spreads incoming connections across them (see gateway.py)
+        self.reuse_port = reuse_port
+        # Registration hooks may block (the gateway's SQLite registry), so
+        # they run on one background thread; a single thread keeps each
+        # device's register/unregister calls in order
+        self.on_register = on_register
+        self.on_unregister = on_unregister
+        self.hook_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="device-hooks")
+        self.on_publish = on_publish
         self.device_map = {}
+        # Link statistics outlive the socket so reconnects can be counted
+        self.device_links = {}
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_missed_pongs = max_missed_pongs
+        # Per-connection limits. rate_limit is readings (or other messages)
+        # per second with a token bucket of rate_burst; None disables it.
+        # Oversized or throttled frames are dropped unparsed, and after
+        # disconnect_after violations (None: never) the socket is closed.
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.max_message_size = max_message_size
+        self.max_pending_per_connection = max_pending_per_connection
+        self.disconnect_after = disconnect_after
+        # Printing every reading is synchronous on the event loop; only for
+        # debugging a device
+        self.log_readings = log_readings
+        self.limit_stats = {"throttled": 0, "oversized": 0, "disconnected": 0}
         self.sensor_data = {}
+        self.buffer_size = buffer_size
+        self.sensor_buffers = {}
+        self.subscribers = {}
+        self.device_groups = {name: list(ids) for name, ids in (groups or {}).items()}
+        self.pending_commands = {}
+        self._command_ids = itertools.count(1)
         self.loop = None
         self.on_sensor_data = on_sensor_data
+        self.on_sensor_batch = on_sensor_batch
+
+        # Sensor callbacks (e.g. SQLite inserts) can block, so they are queued
+        # and run in a thread pool by worker tasks instead of on the loop.
+        self.sink_workers = sink_workers
+        self.sink_queue_size = sink_queue_size
+        self.overflow_policy = overflow_policy
+        self.sink_queue = None
+        self.executor = ThreadPoolExecutor(max_workers=sink_workers,
+                                           thread_name_prefix="sensor-sink")
+        self.sink_stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "dropped": 0,
+            "failed": 0,
+            "last_lag_ms": 0.0,
+            "max_lag_ms": 0.0,
+            "total_lag_ms": 0.0
+        }
+
+    def _decode(self, message, encoding):
+        # Text frames are always JSON; binary frames use the encoding agreed
+        # at registration.
+        if isinstance(message, bytes):
+            if encoding != "msgpack":
+                raise ValueError("binary frame without a negotiated encoding")
+            return msgpack.unpackb(message, raw=False)
+        return json.loads(message)
 
     async def handle_client(self, websocket):
+        device_id = None
+        encoding = "json"
+        bucket = TokenBucket(self.rate_limit, self.rate_burst) if self.rate_limit else None
+        # Sink items this connection may have queued; once they are used up
+        # the connection stops reading, so a flood backs up into the
+        # device's own TCP window instead of the shared queue
+        gate = asyncio.Semaphore(self.max_pending_per_connection)
+        violations = 0
         try:
             async for message in websocket:
+                if len(message) > self.max_message_size:
+                    violations += 1
+                    if await self._reject(websocket, device_id, "oversized", violations):
+                        break
+                    continue
+                if bucket is not None and not bucket.take():
+                    violations += 1
+                    if await self._reject(websocket, device_id, "throttled", violations):
+                        break
+                    continue
                 try:
-                    data = json.loads(message)
-                except json.JSONDecodeError as e:
-                    print(f"Invalid JSON: {message}")
+                    data = self._decode(message, encoding)
+                except Exception as e:
+                    print(f"Invalid message: {message!r}")
                     print(f"Error: {e}")
                     continue
                 if data["msg_type"] == "register":
                     device_id = data["device_id"]
                     self.device_map[device_id] = websocket
+                    self._get_link(device_id).on_connect()
                     print(f"{device_id} connected.")
+                    if self.on_register:
+                        self._run_hook(self.on_register, device_id)
                     ack = {
                         "msg_type": "registration_ack",
                         "device_id": device_id,
                         "timestamp": int(time.time())
                     }
+                    if msgpack is not None and "msgpack" in data.get("encodings", []):
+                        encoding = ack["encoding"] = "msgpack"
+                    await self._send_device(device_id, websocket, json.dumps(ack))
+                    self.publish("device", {"device_id": device_id, "status": "connected"})
+                elif data["msg_type"] == "subscribe":
+                    self._subscribe(websocket, data)
+                    ack = {
+                        "msg_type": "subscribe_ack",
+                        "topics": sorted(self.subscribers[websocket]["topics"])
+                    }
                     await websocket.send(json.dumps(ack))
+                elif data["msg_type"] == "command_ack":
+                    future = self.pending_commands.get(data["cmd_id"])
+                    if future is not None and not future.done():
+                        future.set_result(data.get("status", "ok"))
                 elif data["msg_type"] == "sensor_data":
                     device_id = data["device_id"]
                     sensor_id = data["sensor_id"]
                     value = data["value"]
 
-                    self.sensor_data.setdefault(device_id, {})[sensor_id] = value
-                    print(f"{device_id} - {sensor_id}: {value}")
+                    self._record_reading(device_id, sensor_id, value, time.time())
+                    if self.log_readings:
+                        print(f"{device_id} - {sensor_id}: {value}")
                     if self.on_sensor_data:
-                        self.on_sensor_data(device_id, sensor_id, value)
+                        await self._dispatch(self.on_sensor_data, device_id, sensor_id, value,
+                                             gate=gate)
+                elif data["msg_type"] == "sensor_batch":
+                    device_id = data["device_id"]
+                    readings = self._parse_batch(data)
+                    if bucket is not None:
+                        bucket.charge(len(readings) - 1)
+                    for sensor_id, value, ts in readings:
+                        self._record_reading(device_id, sensor_id, value, ts)
+                    if self.log_readings:
+                        print(f"{device_id} - batch of {len(readings)} readings")
+                    if self.on_sensor_batch:
+                        await self._dispatch(self.on_sensor_batch, device_id, readings,
+                                             gate=gate)
+                    elif self.on_sensor_data:
+                        for sensor_id, value, _ in readings:
+                            await self._dispatch(self.on_sensor_data, device_id, sensor_id,
+                                                 value, gate=gate)
                 else:
                     print(f"Unknown message type: {data['msg_type']}")
+
+                if device_id:
+                    self._get_link(device_id).on_message_in(len(message))
                     
         except KeyError:
             print(f"KeyError: {data}")
         except Exception as e:
             print(f"Exception: {e}")
         finally:
-            if device_id and device_id in self.device_map:
-                del self.device_map[device_id]
+            if websocket in self.subscribers:
+                del self.subscribers[websocket]
+            elif device_id and self._remove_device(device_id, websocket):
                 print(f"{device_id} disconnected.")
             else:
                 print(f"Device {device_id} not found.")
+
+    async def _reject(self, websocket, device_id, kind, violations):
+        # Count a dropped frame; returns True once the connection was closed
+        self.limit_stats[kind] += 1
+        if device_id:
+            link = self._get_link(device_id)
+            setattr(link, kind, getattr(link, kind) + 1)
+        if self.disconnect_after is None or violations < self.disconnect_after:
+            return False
+        self.limit_stats["disconnected"] += 1
+        print(f"{device_id or 'Client'} closed after {violations} rate/size violations.")
+        await websocket.close(code=1008, reason="rate limit exceeded")
+        return True
+
+    def _remove_device(self, device_id, websocket):
+        # Only forget the device if it hasn't already reconnected on a newer
+        # socket (or been evicted by the heartbeat)
+        if self.device_map.get(device_id) is not websocket:
+            return False
+        del self.device_map[device_id]
+        self._get_link(device_id).on_disconnect()
+        if self.on_unregister:
+            self._run_hook(self.on_unregister, device_id)
+        self.publish("device", {"device_id": device_id, "status": "disconnected"})
+        return True
+
+    def _run_hook(self, hook, device_id):
+        def call():
+            try:
+                hook(device_id)
+            except Exception as e:
+                print(f"Device hook error for {device_id}: {e}")
+        self.hook_executor.submit(call)
+
+    def _get_link(self, device_id):
+        link = self.device_links.get(device_id)
+        if link is None:
+            link = self.device_links[device_id] = DeviceLink(device_id)
+        return link
+
+    async def _send_device(self, device_id, websocket, message):
+        await websocket.send(message)
+        self._get_link(device_id).on_message_out(len(message))
+
+    async def _ping_device(self, device_id, websocket):
+        link = self._get_link(device_id)
+        start = time.monotonic()
+        try:
+            pong_waiter = await websocket.ping()
+            await asyncio.wait_for(pong_waiter, self.heartbeat_timeout)
+        except asyncio.TimeoutError:
+            link.missed_pongs += 1
+        except Exception:
+            # Sending the ping failed, the socket is already gone
+            link.missed_pongs = self.max_missed_pongs
+        else:
+            link.on_pong((time.monotonic() - start) * 1000)
+            return
+
+        if link.missed_pongs >= self.max_missed_pongs and self._remove_device(device_id, websocket):
+            # Half-open connections never finish the closing handshake, so
+            # don't wait on it here
+            link.evictions += 1
+            print(f"{device_id} evicted after {link.missed_pongs} missed heartbeats.")
+            asyncio.create_task(websocket.close())
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await asyncio.gather(*(
+                self._ping_device(device_id, websocket)
+                for device_id, websocket in list(self.device_map.items())
+            ))
+
+    async def _dispatch(self, callback, *args, gate=None):
+        if gate is not None:
+            await gate.acquire()
+        item = (time.monotonic(), callback, args, gate)
+        queue = self.sink_queue
+        if queue.full():
+            if self.overflow_policy == "drop_newest":
+                self.sink_stats["dropped"] += 1
+                if gate is not None:
+                    gate.release()
+                return
+            if self.overflow_policy == "drop_oldest":
+                dropped_gate = queue.get_nowait()[3]
+                queue.task_done()
+                if dropped_gate is not None:
+                    dropped_gate.release()
+                self.sink_stats["dropped"] += 1
+        # With the "block" policy this waits for room, which also stops this
+        # connection from reading further frames.
+        await queue.put(item)
+        self.sink_stats["enqueued"] += 1
+
+    async def _sink_worker(self):
+        loop = asyncio.get_running_loop()
+        stats = self.sink_stats
+        while True:
+            enqueued_at, callback, args, gate = await self.sink_queue.get()
+            lag_ms = (time.monotonic() - enqueued_at) * 1000
+            stats["last_lag_ms"] = lag_ms
+            stats["max_lag_ms"] = max(stats["max_lag_ms"], lag_ms)
+            stats["total_lag_ms"] += lag_ms
+            try:
+                await loop.run_in_executor(self.executor, callback, *args)
+                stats["processed"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"Sensor sink error: {e}")
+            finally:
+                if gate is not None:
+                    gate.release()
+                self.sink_queue.task_done()
+
+    def get_sink_stats(self):
+        stats = dict(self.sink_stats)
+        started = stats["processed"] + stats["failed"]
+        stats["avg_lag_ms"] = stats.pop("total_lag_ms") / started if started else 0.0
+        for key in ("last_lag_ms", "max_lag_ms", "avg_lag_ms"):
+            stats[key] = round(stats[key], 3)
+        stats["queue_depth"] = self.sink_queue.qsize() if self.sink_queue else 0
+        stats["queue_size"] = self.sink_queue_size
+        stats["workers"] = self.sink_workers
+        stats["overflow_policy"] = self.overflow_policy
+        stats["limits"] = dict(self.limit_stats)
+        return stats
+
+    def _parse_batch(self, data):
+        # {"msg_type": "sensor_batch", "device_id": ..., "now": <device millis>,
+        #  "readings": [[sensor_id, <device millis>, value], ...]}
+        # Device clocks are only millis() since boot, so each reading is placed
+        # relative to the arrival time of the batch.
+        received = time.time()
+        now = data["now"]
+        return [
+            (sensor_id, float(value), received - (now - millis) / 1000.0)
+            for sensor_id, millis, value in data["readings"]
+        ]
+
+    def _record_reading(self, device_id, sensor_id, value, ts):
+        self.sensor_data.setdefault(device_id, {})[sensor_id] = value
+        self._get_buffer(device_id, sensor_id).append(ts, float(value))
+        self.publish("sensor", {
+            "device_id": device_id,
+            "sensor_id": sensor_id,
+            "value": value,
+            "timestamp": int(ts)
+        })
+
+    def _subscribe(self, websocket, data):
+        # Browsers subscribe with {"msg_type": "subscribe", "topics": [...],
+        # "device_ids": [...]}; a missing device_ids means every device.
+        topics = set(data.get("topics") or self.TOPICS) & set(self.TOPICS)
+        device_ids = data.get("device_ids")
+        self.subscribers[websocket] = {
+            "topics": topics,
+            "device_ids": set(device_ids) if device_ids else None
+        }
+
+    def publish(self, topic, payload, local=False):
+        # Safe to call from any thread; the send happens on the server loop.
+        # Events not marked local are also handed to on_publish (the gateway
+        # relays them to browsers connected to its other workers).
+        if self.loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._publish(topic, payload, local)
+        else:
+            self.loop.call_soon_threadsafe(self._publish, topic, payload, local)
+
+    def _publish(self, topic, payload, local):
+        self._broadcast(topic, payload)
+        if self.on_publish and not local:
+            self.on_publish(topic, payload)
+
+    def _broadcast(self, topic, payload):
+        device_id = payload.get("device_id")
+        targets = [
+            websocket for websocket, sub in self.subscribers.items()
+            if topic in sub["topics"]
+            and (sub["device_ids"] is None or device_id is None or device_id in sub["device_ids"])
+        ]
+        if not targets:
+            return
+        message = json.dumps({"msg_type": "event", "topic": topic, **payload})
+        self._send_broadcast(targets, message)
+
+    def _send_broadcast(self, targets, message):
+        # broadcast() writes without waiting for drain, so a slow browser
+        # cannot hold up device message handling
+        websockets.broadcast(targets, message)
+
+    def _start_background(self):
+        # Must be called on the running server loop
+        self.loop = asyncio.get_running_loop()
+        self.sink_queue = asyncio.Queue(maxsize=self.sink_queue_size)
+        for _ in range(self.sink_workers):
+            asyncio.create_task(self._sink_worker())
+        if self.heartbeat_interval:
+            asyncio.create_task(self._heartbeat())
+
     async def _start_async(self):
-        async with websockets.serve(self.handle_client, self.host, self.port):
+        self._start_background()
+        # The heartbeat replaces the library's own keepalive pings
+        # The library cap only bounds memory; handle_client enforces
+        # max_message_size itself so oversized frames are counted, not fatal
+        async with websockets.serve(self.handle_client, self.host, self.port,
+                                    reuse_port=self.reuse_port, ping_interval=None,
+                                    max_size=4 * self.max_message_size):
             print(f"Server started on {self.host}:{self.port}")
             while True:
                 await asyncio.sleep(1)
@@ -66,18 +430,109 @@ class WebsocketServer:
                          args=(self._start_async(),),
                          daemon=True).start()
  
-    def send_led_command(self, device_id, value):
-        cmd = {"msg_type": "led_command", "device_id": device_id, "value": value}
-        asyncio.run_coroutine_threadsafe(
-            self.device_map[device_id].send(json.dumps(cmd)), self.loop
+    def set_group(self, name, device_ids):
+        self.device_groups[name] = list(device_ids)
+
+    def get_groups(self):
+        return {name: list(ids) for name, ids in self.device_groups.items()}
+
+    def resolve_targets(self, targets):
+        return resolve_targets(self.device_groups, targets)
+
+    async def _send_command_to(self, device_id, value, timeout):
+        websocket = self.device_map.get(device_id)
+        if websocket is None:
+            return {"status": "not_connected", "latency_ms": None}
+
+        cmd_id = next(self._command_ids)
+        cmd = {"msg_type": "led_command", "device_id": device_id, "value": value,
+               "cmd_id": cmd_id}
+        future = asyncio.get_running_loop().create_future()
+        self.pending_commands[cmd_id] = future
+        link = self._get_link(device_id)
+        start = time.monotonic()
+        try:
+            await self._send_device(device_id, websocket, json.dumps(cmd))
+            ack_status = await asyncio.wait_for(future, timeout)
+            latency_ms = (time.monotonic() - start) * 1000
+            link.on_command(latency_ms)
+            return {
+                "status": "acked" if ack_status == "ok" else ack_status,
+                "latency_ms": round(latency_ms, 3)
+            }
+        except asyncio.TimeoutError:
+            link.on_command(None)
+            return {"status": "timeout", "latency_ms": None}
+        except Exception as e:
+            link.on_command(None)
+            return {"status": "error", "error": str(e), "latency_ms": None}
+        finally:
+            self.pending_commands.pop(cmd_id, None)
+
+    async def send_command_async(self, targets, value, timeout=2.0):
+        device_ids = self.resolve_targets(targets)
+        results = await asyncio.gather(*(
+            self._send_command_to(device_id, value, timeout)
+            for device_id in device_ids
+        ))
+        return dict(zip(device_ids, results))
+
+    def send_command(self, targets, value, timeout=2.0):
+        # Blocking wrapper for other threads; every device gets its own
+        # timeout, so this returns within roughly 'timeout' seconds.
+        future = asyncio.run_coroutine_threadsafe(
+            self.send_command_async(targets, value, timeout), self.loop
         )
+        return future.result(timeout + 1)
+
+    def send_led_command(self, device_id, value, timeout=2.0):
+        # Single device only; send_command() handles group fan-out
+        if device_id in self.device_groups:
+            raise ValueError(f"{device_id} is a group, use send_command() for groups")
+        return self.send_command(device_id, value, timeout)[device_id]
 
     def get_sensor_data(self, device_id):
         return self.sensor_data.get(device_id, {})
 
+    def _get_buffer(self, device_id, sensor_id):
+        key = (device_id, sensor_id)
+        buffer = self.sensor_buffers.get(key)
+        if buffer is None:
+            buffer = self.sensor_buffers[key] = SensorRingBuffer(self.buffer_size)
+        return buffer
+
+    def get_recent_readings(self, device_id, sensor_id, seconds):
+        buffer = self.sensor_buffers.get((device_id, sensor_id))
+        if buffer is None:
+            return [], []
+        return buffer.window(seconds)
+
+    def get_recent_stats(self, device_id, sensor_id, seconds):
+        buffer = self.sensor_buffers.get((device_id, sensor_id))
+        if buffer is None:
+            return {'count': 0, 'min': None, 'max': None, 'avg': None}
+        return buffer.stats(seconds)
+
+    def get_buffered_history(self, device_id, sensor_id, hours, bucket=3600, tz_offset=0):
+        # Serve history from memory only when the buffer reaches back to the
+        # start of the first bucket; otherwise the caller goes to the database.
+        buffer = self.sensor_buffers.get((device_id, sensor_id))
+        if buffer is None:
+            return None
+        now = time.time()
+        start = int(now) - hours * 3600 + bucket
+        start -= (start + tz_offset) % bucket
+        oldest = buffer.oldest_timestamp()
+        if oldest is None or oldest > start:
+            return None
+        return buffer.bucketed(now - start, bucket, tz_offset, now)
+
     def get_device_list(self):
         return list(self.device_map.keys())
 
+    def get_device_stats(self):
+        return [self.device_links[device_id].to_dict() for device_id in sorted(self.device_links)]
+
 if __name__ == "__main__":
     srv = WebsocketServer()
     srv.start_in_thread()
\ No newline at end of file